@@ -1,9 +1,40 @@
-from openai import OpenAI
+import asyncio
 import json
-import requests
 import time
 import base64
 import random
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+
+import httpx
+
+import breaker
+import catalog
+import fanout
+import http_client
+import last_good
+import llm_cache
+import metrics
+import payloads
+import response_cache
+import spotify_library
+import swipe_store
+import swipe_db
+import timing
+import user_sessions
+import weather_cache
+from breaker import CircuitOpen
+from deadline import remaining, spawn_detached
+from tracks import Track, CandidateSet, extract_track_id, intern_ids
+
+def local_recommender():
+    """The co-occurrence model (cooccurrence.model). Imported on first use:
+    numpy + scipy add ~0.25s to every worker's start-up (main.warm_up loads it in a thread)."""
+    from cooccurrence import model
+    return model
 
 def parse_text_recommendations(text_block):
     """
@@ -26,69 +57,173 @@ def parse_text_recommendations(text_block):
     return recommendations
 
 
+class RecommendationStreamParser:
+    """
+    Incremental version of parse_text_recommendations for streamed output.
+    feed() takes chunks as they arrive and returns every record whose '---'
+    separator has come in. Only the unfinished last line is buffered, so
+    nothing already parsed is scanned again.
+    """
+
+    def __init__(self):
+        self._partial = ""  # text after the last newline
+        self._rec = {}
+
+    def feed(self, chunk):
+        out = []
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line, out)
+        return out
+
+    def close(self):
+        """Flush the tail of the stream; a trailing block is kept only if it looks complete."""
+        out = []
+        if self._partial:
+            self._line(self._partial, out)
+            self._partial = ""
+        if self._rec.get("title") and self._rec.get("artist"):
+            out.append(self._rec)
+        self._rec = {}
+        return out
+
+    def _line(self, line, out):
+        *done, rest = line.split('---')
+        for part in done:
+            self._field(part)
+            if self._rec:
+                out.append(self._rec)
+                self._rec = {}
+        self._field(rest)
+
+    def _field(self, line):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            self._rec[key.strip().lower().replace(' ', '_')] = value.strip()
+
+
 
 # ========================================
 # SPOTIFY API FUNCTIONS
 # ========================================
-def get_spotify_profile(access_token):
+# Reads go through response_cache (per-user TTL/LRU + ETag revalidation)
+async def get_spotify_profile(access_token):
     url = "https://api.spotify.com/v1/me"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else None
+    return await response_cache.spotify_get(access_token, "profile", url)
 
-def get_spotify_top_tracks(access_token, limit=10):
-    url = f"https://api.spotify.com/v1/me/top/tracks?limit={limit}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
-    return response.json()["items"] if response.status_code == 200 else []
+async def get_spotify_top_tracks(access_token, limit=10):
+    url = "https://api.spotify.com/v1/me/top/tracks"
+    data = await response_cache.spotify_get(access_token, "top_tracks", url, {"limit": limit})
+    return data["items"] if data else []
 
-def get_spotify_recently_played(access_token, limit=10):
-    url = f"https://api.spotify.com/v1/me/player/recently-played?limit={limit}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
-    return response.json()["items"] if response.status_code == 200 else []
+async def get_spotify_recently_played(access_token, limit=10):
+    url = "https://api.spotify.com/v1/me/player/recently-played"
+    data = await response_cache.spotify_get(access_token, "recently_played", url, {"limit": limit})
+    return data["items"] if data else []
 
 
-# Fetches up to 50 saved tracks from the user's Spotify library
-# and returns 'limit' number of randomly selected track objects.
-# Each track object includes name, artists, preview_url, album art, and Spotify link.
-def get_spotify_starting_songs(access_token, limit=5):
+# ========================================
+# STARTER SONG POOLS
+# ========================================
+# Each user gets a uniform random sample of their *whole* saved library,
+# built once in the background by walking every page of /v1/me/tracks
+# (reservoir sampling, constant memory). /get-starting-songs and the top-up in
+# get_recommendations_from_swipes both draw from it without another round trip.
+#
+# A cold pool answers as soon as the first page (the user's most recent saves)
+# is in, rather than after the whole walk. Such draws are reported as partial
+# (draw_starting_songs; /get-starting-songs sends X-Starter-Pool: partial),
+# and draws after the walk finishes sample the whole library.
+STARTER_POOL_SIZE = 100
+STARTER_POOL_TTL_S = 30 * 60
+MAX_STARTER_POOLS = 1000
+
+class _StarterPool:
+    __slots__ = ("reservoir", "created_at", "ready", "complete", "task")
+
+    def __init__(self):
+        self.reservoir = spotify_library.Reservoir(STARTER_POOL_SIZE)
+        self.created_at = time.monotonic()
+        self.ready = asyncio.Event()  # set once the first page is in
+        self.complete = False         # the whole library has been walked
+        self.task = None
+
+_starter_pools = OrderedDict()
+
+async def _user_key(access_token):
+    # Same identity the response cache uses, so a refreshed token keeps its pool
+    try:
+        uid = await response_cache.get_user_id(access_token)
+    except (CircuitOpen, httpx.HTTPError):
+        uid = None
+    return uid or hashlib.sha256(access_token.encode()).hexdigest()[:32]
+
+async def _fill_starter_pool(key, pool, access_token):
+    try:
+        async for track in spotify_library.iter_saved_tracks(access_token):
+            catalog.index.add(track)
+            pool.reservoir.add(track)
+            if pool.reservoir.seen >= spotify_library.PAGE_SIZE:
+                pool.ready.set()
+        pool.complete = True
+    except Exception as e:
+        print("Starter pool error:", e)
+    finally:
+        pool.ready.set()
+        # Don't keep an empty pool around (e.g. expired token) -> retry next time
+        if not pool.reservoir.items and _starter_pools.get(key) is pool:
+            del _starter_pools[key]
+
+async def _starter_pool(access_token):
+    key = await _user_key(access_token)
+    pool = _starter_pools.get(key)
+    expired = pool is not None and time.monotonic() - pool.created_at > STARTER_POOL_TTL_S
+    if expired and breaker.is_open("spotify"):
+        # Can't rebuild it right now -> keep serving the old pool
+        breaker.mark_degraded("spotify")
+        expired = False
+    if pool is None or expired:
+        pool = _starter_pools[key] = _StarterPool()
+        pool.task = spawn_detached(_fill_starter_pool(key, pool, access_token))
+        while len(_starter_pools) > MAX_STARTER_POOLS:
+            _starter_pools.popitem(last=False)
+    else:
+        _starter_pools.move_to_end(key)
+    # The first page is enough to answer; the rest of the library keeps
+    # streaming into the reservoir in the background.
+    await pool.ready.wait()
+    return pool
 
-    url = "https://api.spotify.com/v1/me/tracks?limit=50"
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
+async def get_starter_pool(access_token):
+    return (await _starter_pool(access_token)).reservoir.items
 
-    response = requests.get(url, headers=headers)
+def _sample_tracks(tracks, limit, excludes=()):
+    # excludes: sets of interned track ids (or a SeenIndex) to leave out
+    pool = CandidateSet(tracks).without(*excludes)
+    return random.sample(pool.tracks, min(limit, len(pool)))
 
-    if response.status_code != 200:
-        print(f"Spotify API error: {response.status_code} - {response.text}")
-        return []
+async def _draw_starter_tracks(access_token, limit=5, excludes=()):
+    return _sample_tracks(await get_starter_pool(access_token), limit, excludes)
 
-    items = response.json().get("items", [])
-    if not items:
-        return []
+async def draw_starter_songs(access_token, limit=5, excludes=()):
+    return [t.as_card() for t in await _draw_starter_tracks(access_token, limit, excludes)]
 
-    # Extract and simplify fields for frontend
-    simplified = []
-    for item in items:
-        track = item["track"]
-        # preview_url = track.get("preview_url")
-
-        # if not preview_url:
-        #     continue  # Skip songs with no preview
-
-        simplified.append({
-            "title": track.get("name"),
-            "artist": track.get("artists", [{}])[0].get("name"),
-            # "preview_url": preview_url,
-            "preview_url": track.get("preview_url"),
-            "image_url": track.get("album", {}).get("images", [{}])[0].get("url"),
-            "spotify_url": track.get("external_urls", {}).get("spotify"),
-        })
+async def draw_starting_songs(access_token, limit=5):
+    """(cards, complete): complete is False while the pool only holds part of the library."""
+    pool = await _starter_pool(access_token)
+    complete = pool.complete
+    return [t.as_card() for t in _sample_tracks(pool.reservoir.items, limit)], complete
+
+# Returns 'limit' randomly selected tracks from the user's saved library.
+# Each track object includes name, artists, preview_url, album art, and Spotify link.
+async def get_spotify_starting_songs(access_token, limit=5):
+    return (await draw_starting_songs(access_token, limit))[0]
 
-    # Pick a random subset from those with previews
-    return random.sample(simplified, min(limit, len(simplified)))
+async def iter_starting_songs(access_token, limit=5):
+    # Streaming flavour of get_spotify_starting_songs
+    for track in await draw_starter_songs(access_token, limit):
+        yield track
 
 # def get_access_token(client_id, client_secret):
 #     auth_str = f"{client_id}:{client_secret}"
@@ -122,6 +257,7 @@ def get_user_access_token(client_id, client_secret, redirect_uri, code):
         "client_id": client_id,
         "client_secret": client_secret
     }
+    import requests  # only this one-off OAuth exchange uses it; keep it off worker start-up
     response = requests.post(url, headers=headers, data=data)
     if response.status_code == 200:
         return response.json()
@@ -132,14 +268,17 @@ def get_user_access_token(client_id, client_secret, redirect_uri, code):
 # ========================================
 # WEATHER API FUNCTION
 # ========================================
-def get_weather_data(api_key, city="Tel Aviv"):
+async def get_weather_data(api_key, city="Tel Aviv", lat=None, lon=None):
     url = "http://api.openweathermap.org/data/2.5/weather"
     params = {
-        "q": city,
         "appid": api_key,
         "units": "metric"
     }
-    response = requests.get(url, params=params)
+    if lat is not None and lon is not None:
+        params.update(lat=lat, lon=lon)
+    else:
+        params["q"] = city
+    response = await http_client.get(url, params=params)
     if response.status_code == 200:
         data = response.json()
         weather_desc = data["weather"][0]["description"]
@@ -150,11 +289,31 @@ def get_weather_data(api_key, city="Tel Aviv"):
         return {}
 
 
-def build_user_profile(spotify_token, weather_api_key):
-    profile = get_spotify_profile(spotify_token)
-    top_tracks = get_spotify_top_tracks(spotify_token, limit=5)
-    recent_tracks = get_spotify_recently_played(spotify_token, limit=5)
-    weather = get_weather_data(weather_api_key)
+def get_weather_context(api_key, city="Tel Aviv", lat=None, lon=None):
+    # Served from weather_cache without waiting: weather changes slowly, so a
+    # background refresh per city/geo bucket is enough for every request.
+    if not api_key:
+        return {}
+    key = weather_cache.weather_key(city, lat, lon)
+    if key[0] == "geo":
+        lat, lon = weather_cache.bucket_center(key)
+    return weather_cache.cache.get(key, lambda: get_weather_data(api_key, city, lat, lon))
+
+async def build_user_profile(spotify_token, weather_api_key):
+    # The Spotify calls are independent -> run them together, so the profile
+    # costs roughly the slowest call, not the sum. Weather never waits.
+    with timing.stage("weather"):
+        weather = get_weather_context(weather_api_key)
+    with timing.stage("profile_fetch"):
+        profile, top_tracks, recent_tracks = await asyncio.gather(
+            get_spotify_profile(spotify_token),
+            get_spotify_top_tracks(spotify_token, limit=5),
+            get_spotify_recently_played(spotify_token, limit=5),
+        )
+
+    # Any of these can come back empty when Spotify is rate limiting us;
+    # build what we can instead of failing the whole profile
+    profile = profile or {}
 
     # Build listening history
     listening_history = []
@@ -178,7 +337,7 @@ def build_user_profile(spotify_token, weather_api_key):
 
     user_profile = {
         "user_profile": {
-            "user_id": profile["id"],
+            "user_id": profile.get("id"),
             "display_name": profile.get("display_name"),
             "email": profile.get("email"),
             "country": profile.get("country"),
@@ -232,7 +391,8 @@ def build_user_profile(spotify_token, weather_api_key):
 # IMPLIMWENT USER FEEDBACK TO LOGIC
 # =============================================================================
 
-user_story = []
+# Liked lyrics live in per-user, bounded sessions (see user_sessions.py),
+# not in a module-level list shared by every request.
 
 def GetUserResponseToSuggestion(curret_reccomended_song, user_story):
     #print(user_story)
@@ -257,8 +417,15 @@ def GetUserResponseToSuggestion(curret_reccomended_song, user_story):
 
 
 def addLyricToUserStoryAfterLike(curret_reccomended_song, user_profile):
-    user_profile["user_profile"]["liked_songs_details"].append(curret_reccomended_song)
-    user_profile["user_profile"]["user_story"].append(curret_reccomended_song["suggested_lyrics"])
+    profile = user_profile["user_profile"]
+    lyric = curret_reccomended_song["suggested_lyrics"]
+    profile["liked_songs_details"].append(curret_reccomended_song)
+    profile["liked_songs_details"][:-user_sessions.MAX_LYRICS] = []
+    profile["user_story"].append(lyric)
+    profile["user_story"][:-user_sessions.MAX_LYRICS] = []
+    # No user id (profile fetch failed) -> no session; they'd all share one
+    if profile.get("user_id") is not None:
+        user_sessions.get_session(profile["user_id"]).add_lyric(lyric)
     return
 
 final_analysis_prompt = (
@@ -269,29 +436,67 @@ final_analysis_prompt = (
     "Use a warm, encouraging tone. Make it 3-4 sentences, focusing on empathy and understanding."
 )
 
-def get_final_user_analysis(user_story, openai_client):
-    # Prepare the prompt, inserting the actual user story
-    prompt_text = final_analysis_prompt.format(user_story='\n'.join(user_story))
+incremental_analysis_prompt = (
+    "You are a compassionate, insightful music assistant.\n"
+    "This is what you have written so far about a user, based on the lyrics they liked:\n\n"
+    "{summary}\n\n"
+    "Since then they have chosen these new lyrics:\n\n"
+    "{new_lyrics}\n\n"
+    "Update the analysis of the user's character and emotional state so it reflects the new lyrics too.\n"
+    "Use a warm, encouraging tone. Make it 3-4 sentences, focusing on empathy and understanding."
+)
 
-    print("\n--- SENDING FINAL ANALYSIS PROMPT TO CHATGPT ---\n")
-    response = openai_client.chat.completions.create(
+analysis_system_message = (
+    "You are a music assistant who writes warm, friendly character analyses based on song lyrics.\n"
+    "Do not mention that you are an AI. Do not talk about your process. Simply respond to the user."
+)
+
+def _analysis_completion(prompt_text, openai_client, user_id=None, near_duplicates=True):
+    # Same prompt as a recent one -> reuse that analysis; nearly the same one
+    # only if it was this user's (the analysis is about them)
+    return llm_cache.cached_chat_completion(
+        openai_client,
         model="gpt-4",
         messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are a music assistant who writes warm, friendly character analyses based on song lyrics.\n"
-                    "Do not mention that you are an AI. Do not talk about your process. Simply respond to the user."
-                )
-            },
+            {"role": "system", "content": analysis_system_message},
             {"role": "user", "content": prompt_text}
         ],
-        temperature=0.7
-    )
+        temperature=0.7,
+        near_duplicates=near_duplicates,
+        owner=user_id,
+    ).strip()
 
-    # Extract and return the final analysis
-    final_analysis = response.choices[0].message.content.strip()
-    return final_analysis
+def get_final_user_analysis(user_story, openai_client, user_id=None):
+    # Prepare the prompt, inserting the actual user story
+    prompt_text = final_analysis_prompt.format(user_story='\n'.join(user_story))
+
+    print("\n--- SENDING FINAL ANALYSIS PROMPT TO CHATGPT ---\n")
+    return _analysis_completion(prompt_text, openai_client, user_id)
+
+def get_incremental_user_analysis(user_id, openai_client):
+    """
+    Rolling analysis for a user's session: only the lyrics liked since the last
+    call are sent, together with the previous summary, so the prompt stays about
+    the same size however long the session runs.
+    """
+    session = user_sessions.get_session(user_id)
+    if not session.pending:
+        return session.summary
+    new_lyrics = list(session.pending)
+    # Exact cache hits only: a near-duplicate answer never saw the new lyrics,
+    # and they'd be dropped from `pending` below without being analysed
+    if session.summary is None:
+        prompt_text = final_analysis_prompt.format(user_story='\n'.join(new_lyrics))
+    else:
+        prompt_text = incremental_analysis_prompt.format(
+            summary=session.summary, new_lyrics='\n'.join(new_lyrics)
+        )
+    analysis = _analysis_completion(prompt_text, openai_client, user_id, near_duplicates=False)
+    session.summary = analysis
+    # Lyrics liked while the completion ran stay pending for the next update
+    for _ in range(min(len(new_lyrics), len(session.pending))):
+        session.pending.popleft()
+    return analysis
 
 # =============================================================================
 # MAIN INTEGRATION
@@ -443,26 +648,119 @@ system_prompt = (
     "Do not add extra commentary or markdown, just this plain text."
 )
 
+def make_openai_client(api_key=None):
+    # Imported lazily: the openai package alone adds ~0.4s to every worker's start-up
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+def _recommendation_messages(user_profile):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": json.dumps(user_profile)},
+    ]
+
+def get_llm_recommendations(user_profile, openai_client, model="gpt-4", temperature=0.7):
+    text = llm_cache.cached_chat_completion(
+        openai_client, model, _recommendation_messages(user_profile), temperature
+    )
+    return parse_text_recommendations(text)
+
+def stream_llm_recommendations(user_profile, openai_client, model="gpt-4", temperature=0.7, stop=None):
+    """
+    Generator version of get_llm_recommendations: yields each Title/Artist/.../Reason
+    record as soon as its '---' separator is streamed, while the model keeps writing.
+    stop: threading.Event checked on every chunk; once set the HTTP stream is closed
+    (OpenAI stops generating) and nothing is cached.
+    """
+    messages = _recommendation_messages(user_profile)
+    cached = llm_cache.lookup(model, messages, temperature)
+    if cached is not None:
+        yield from parse_text_recommendations(cached)
+        return
+
+    start = time.monotonic()
+    with breaker.get("openai").guard():
+        stream = openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+        )
+    parser = RecommendationStreamParser()
+    parts = []
+    with stream:  # closed however we leave: done, stopped, or the generator closed
+        for chunk in stream:
+            if stop is not None and stop.is_set():
+                return
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield from parser.feed(delta)
+    yield from parser.close()
+    llm_cache.store(model, messages, temperature, "".join(parts), time.monotonic() - start)
+
 #An empty list of user liked lyrics.
 
 # --- NEW HELPERS (put near your Spotify helpers) ---
-import requests
 
 def _simplify_spotify_track(t):
-    return {
-        "title": t.get("name"),
-        "artist": (t.get("artists") or [{}])[0].get("name"),
-        "preview_url": t.get("preview_url"),
-        "image_url": (t.get("album") or {}).get("images", [{}])[0].get("url"),
-        "spotify_url": (t.get("external_urls") or {}).get("spotify"),
-        "id": t.get("id"),
-    }
+    # Id extraction/interning happens here, once per track entering the service
+    track = Track.from_spotify(t)
+    # Every track we've seen becomes resolvable by (title, artist) without a search
+    catalog.index.add(track)
+    return track
+
+def _indexed(tracks):
+    # Same as _simplify_spotify_track for Tracks decoded by payloads
+    for track in tracks:
+        catalog.index.add(track)
+    return tracks
 
-def fetch_user_swipes(username, base_url="http://localhost:5000", direction=None, limit=500):
+# ========================================
+# (TITLE, ARTIST) -> TRACK RESOLUTION
+# ========================================
+async def search_spotify_track(access_token, title, artist):
+    url = "https://api.spotify.com/v1/search"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"q": f"track:{title} artist:{artist}", "type": "track", "limit": 1, "market": "from_token"}
+    r = await http_client.get(url, headers=headers, params=params)
+    if r.status_code != 200:
+        print("Spotify search error:", r.status_code, (r.text or "")[:200])
+        return None
+    tracks = _indexed(payloads.search_tracks(r.content))
+    return tracks[0] if tracks else None
+
+async def resolve_track(access_token, title, artist):
+    """Track for a free-text (title, artist): local catalog first, Spotify search only on a true miss."""
+    track = catalog.index.resolve(title, artist)
+    if track is not None:
+        return track
+    track = await search_spotify_track(access_token, title, artist)
+    if track is not None:
+        # Remember the LLM's spelling too, so the same text resolves locally next time
+        catalog.index.add(track, title=title, artist=artist)
+    return track
+
+async def resolve_recommendations(access_token, recs):
+    """Turn parse_text_recommendations output into a CandidateSet (unresolved ones are dropped)."""
+    found = await asyncio.gather(*(resolve_track(access_token, r.get("title"), r.get("artist")) for r in recs))
+    return CandidateSet(found)
+
+async def warm_catalog():
+    """Index every track the backend knows about (no-op without a db)."""
+    for card in await swipe_db.fetch_all_tracks() or []:
+        catalog.index.add(Track.from_card(card))
+    return len(catalog.index)
+
+async def fetch_user_swipes(username, base_url="http://localhost:5000", direction=None, limit=500, after_id=None):
     params = {"username": username, "limit": limit}
     if direction:
         params["direction"] = direction  # "RIGHT" or "LEFT"
-    r = requests.get(f"{base_url}/api/swipes", params=params, timeout=10)
+    if after_id is not None:
+        params["afterId"] = after_id  # only swipes newer than this Swipe.id, oldest first
+    r = await http_client.get(f"{base_url}/api/swipes", params=params, timeout=10, upstream="node")
     r.raise_for_status()
     data = r.json()
     items = data.get("swipes") or data.get("liked") or []
@@ -471,12 +769,87 @@ def fetch_user_swipes(username, base_url="http://localhost:5000", direction=None
     for s in items:
         track = s.get("track") or {}
         out.append({
+            "id": s.get("id"),
             "trackId": s.get("trackId") or track.get("id"),
             "direction": s.get("direction"),
             "track": track
         })
     return out
 
+SWIPE_SYNC_PAGE = 200  # Node caps ?limit at 200
+
+async def sync_user_swipes(username, base_url="http://localhost:5000"):
+    """Bring the local swipe store up to date, pulling only swipes we haven't seen."""
+    store = swipe_store.get_user_swipes(username)
+    async with store.lock:
+        # Prefer reading the backend's SQLite db directly; HTTP if it's not reachable
+        cols = await swipe_db.fetch_swipes_after(username, store.last_swipe_id)
+        if cols is not None:
+            new = store.add_columns(cols)
+            await _learn_swipes([username] * len(cols), cols, new)
+            return store
+        while True:
+            page = await fetch_user_swipes(username, base_url, limit=SWIPE_SYNC_PAGE, after_id=store.last_swipe_id)
+            new = store.add(page)
+            # Every new swipe also updates the local co-occurrence recommender
+            local_recommender().add_swipes(username, new)
+            if not new or len(page) < SWIPE_SYNC_PAGE:
+                break
+    return store
+
+async def sync_or_keep_swipes(username, base_url="http://localhost:5000"):
+    """sync_user_swipes, but a failed sync (unknown user, Node down) keeps the swipes we already have."""
+    try:
+        await sync_user_swipes(username, base_url)
+    except (CircuitOpen, httpx.HTTPError) as e:
+        print("Swipe sync unavailable, using known swipes:", username, e)
+        breaker.mark_degraded("node")
+
+async def sync_many_user_swipes(usernames, base_url="http://localhost:5000"):
+    """Sync several users with one pooled db query (per-user HTTP syncs without a db)."""
+    stores = {u: swipe_store.get_user_swipes(u) for u in dict.fromkeys(usernames)}
+    if not stores:
+        return stores
+    after_id = min(store.last_swipe_id for store in stores.values())
+    loaded = await swipe_db.fetch_swipes_for_users(list(stores), after_id)
+    if loaded is None:
+        await asyncio.gather(*(sync_or_keep_swipes(u, base_url) for u in stores))
+        return stores
+    users, cols = loaded
+    positions = {}
+    for k, username in enumerate(users):
+        positions.setdefault(username, []).append(k)
+    new = []
+    for username, ks in positions.items():
+        new += stores[username].add_columns(cols, ks)
+    await _learn_swipes(users, cols, sorted(new))
+    return stores
+
+async def _learn_swipes(users, cols, positions):
+    # Feed newly synced swipes to the co-occurrence model, looking up the
+    # metadata of unseen tracks in one deduplicated query
+    if not positions:
+        return
+    track_ids = [cols.track_ids[k] for k in positions]
+    local_recommender().add_columns([users[k] for k in positions], track_ids, [cols.liked[k] for k in positions])
+    tracks = await swipe_db.fetch_tracks(local_recommender().missing_meta(track_ids))
+    local_recommender().add_tracks(tracks or {})
+
+WARM_CHUNK = 20000  # swipes learned per step at warm-up
+
+async def warm_local_recommender():
+    """Load every user's swipes from the db into the co-occurrence model (no-op without a db)."""
+    loaded = await swipe_db.fetch_all_swipes()
+    if loaded is None:
+        return 0
+    users, cols = loaded
+    # In chunks: warm-up runs alongside the first requests, which get the loop in between
+    for lo in range(0, len(cols), WARM_CHUNK):
+        await _learn_swipes(users, cols, range(lo, min(len(cols), lo + WARM_CHUNK)))
+        await asyncio.sleep(0)
+    local_recommender().flush(force=True)
+    return len(cols)
+
 # def get_spotify_recommendations_from_swipes(access_token, seed_track_ids, limit=20):
 #     if not seed_track_ids:
 #         return []
@@ -492,20 +865,7 @@ def fetch_user_swipes(username, base_url="http://localhost:5000", direction=None
 #     tracks = resp.json().get("tracks", [])
 #     return [_simplify_spotify_track(t) for t in tracks]
 
-import re, requests
-ID_RE = re.compile(r"^[A-Za-z0-9]{22}$")
-
-def _extract_track_id(s: str | None) -> str | None:
-    if not s:
-        return None
-    s = s.strip()
-    if ID_RE.match(s):
-        return s
-    # try to pull id from a spotify URL
-    m = re.search(r"/track/([A-Za-z0-9]{22})", s)
-    return m.group(1) if m else None
-
-def get_spotify_recommendations_from_swipes(
+async def get_spotify_recommendations_from_swipes(
     access_token: str,
     seed_track_ids: list[str],
     limit: int = 20,
@@ -514,7 +874,7 @@ def get_spotify_recommendations_from_swipes(
     # 1) normalize + validate seeds
     seeds = []
     for s in (seed_track_ids or []):
-        tid = _extract_track_id(s)
+        tid = extract_track_id(s)
         if tid:
             seeds.append(tid)
     # de-dupe, keep order, max 5
@@ -535,63 +895,237 @@ def get_spotify_recommendations_from_swipes(
     if market:
         params["market"] = market
 
-    # 3) call + robust error logs
-    r = requests.get(url, headers=headers, params=params, timeout=15)
+    # 3) call (status codes and latency are counted in /metrics)
+    r = await http_client.get(url, headers=headers, params=params, timeout=15)
     if r.status_code != 200:
-        print("Spotify recs error:", r.status_code)
-        try:
-            print("Response JSON:", r.json())
-        except Exception:
-            print("Response text:", (r.text or "")[:500])
-        print("Request URL:", r.url)
-        print("Params used:", params)
+        print("Spotify recs error:", r.status_code, (r.text or "")[:200])
         # bubble up so caller can handle (don’t silently return [])
         from fastapi import HTTPException
+        if r.status_code == 429:
+            # Still limited after our retries -> tell the client when to come back
+            retry_after = r.headers.get("Retry-After") or "30"
+            raise HTTPException(status_code=503, detail="spotify_rate_limited", headers={"Retry-After": retry_after})
         raise HTTPException(status_code=502, detail=f"spotify_recommendations_failed_{r.status_code}")
 
-    data = r.json() or {}
-    tracks = data.get("tracks", [])
-    return [_simplify_spotify_track(t) for t in tracks]
-
-def get_recommendations_from_swipes(spotify_token, username, node_base_url="http://localhost:5000", limit=5):
-    # 1) Pull history
-    all_swipes = fetch_user_swipes(username, node_base_url, direction=None, limit=1000)
-    liked = [s for s in all_swipes if str(s.get("direction")).upper() == "RIGHT"]
-    already_ids = {s.get("trackId") for s in all_swipes if s.get("trackId")}
-
-    # 2) If no likes yet → fallback to your existing starter
-    if not liked:
-        #from ChatxLastFMreccomends import get_spotify_starting_songs
-        return get_spotify_starting_songs(spotify_token, limit)  # existing util
-
-    # 3) Seed Spotify recs with RIGHT swipes
-    seed_ids = [s["trackId"] for s in liked if s.get("trackId")]
-    candidates = get_spotify_recommendations_from_swipes(spotify_token, seed_ids, limit=50)
-
-    # 4) Filter out anything already swiped
-    def _id_from_url(spotify_url):
-        # Best-effort: extract ID from URL if needed
-        import re
-        if not spotify_url: return ""
-        m = re.search(r"/track/([A-Za-z0-9]{22})", spotify_url)
-        return m.group(1) if m else ""
-
-    filtered = []
-    for c in candidates:
-        tid = c.get("id") or _id_from_url(c.get("spotify_url"))
-        if tid and tid not in already_ids:
-            filtered.append(c)
-
-    # 5) Ensure exactly 5, top up from starting songs if needed
-    out = filtered[:limit]
-    if len(out) < limit:
-        fallback = get_spotify_starting_songs(spotify_token, limit=limit)  # existing util
-        seen = {(x.get("id") or _id_from_url(x.get("spotify_url"))) for x in out}
-        for f in fallback:
-            fid = _id_from_url(f.get("spotify_url"))
-            if fid and fid not in already_ids and fid not in seen:
-                out.append(f)
-                seen.add(fid)
-            if len(out) >= limit:
-                break
-    return out
+    return CandidateSet(_indexed(payloads.recommendation_tracks(r.content)))
+
+# ========================================
+# CANDIDATE SOURCES
+# ========================================
+# Remote candidates come from every configured source at once (fanout.merge):
+# Spotify's seed recommendations, Last.fm similar tracks for recent likes and
+# the LLM flow (system_prompt). Each source yields lists of Tracks as its
+# answers come in (Spotify: one batch; Last.fm, LLM: one track per resolved
+# (title, artist)); iter_recommendations filters them in arrival order and
+# cancels the rest once it has `limit`.
+LASTFM_URL = "https://ws.audioscrobbler.com/2.0/"
+LASTFM_SEEDS = 3              # recent likes asked about
+LASTFM_SIMILAR_PER_SEED = 10
+SOURCES_MAX_S = 10.0          # fan-out cap when there's no request budget (prefetch)
+TOPUP_RESERVE_S = 0.5         # budget left for the starter-pool top-up after the fan-out
+LLM_MAX_STREAMS = 8           # concurrent OpenAI streams (each holds a worker thread)
+
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_STREAMS, thread_name_prefix="llm")
+
+async def get_lastfm_similar_tracks(api_key, title, artist, limit=LASTFM_SIMILAR_PER_SEED):
+    """(title, artist) pairs Last.fm finds similar to a track, best match first."""
+    params = {
+        "method": "track.getsimilar",
+        "track": title,
+        "artist": artist,
+        "autocorrect": 1,
+        "limit": limit,
+        "api_key": api_key,
+        "format": "json",
+    }
+    r = await http_client.get(LASTFM_URL, params=params)
+    data = payloads.loads(r.content) if r.status_code == 200 else {}
+    if r.status_code != 200 or "error" in data:
+        print("Last.fm error:", r.status_code, data.get("message") or (r.text or "")[:200])
+        return []
+    items = (data.get("similartracks") or {}).get("track") or []
+    return [(t.get("name"), (t.get("artist") or {}).get("name")) for t in items if t.get("name")]
+
+async def _resolve_quietly(access_token, title, artist):
+    try:
+        return await resolve_track(access_token, title, artist)
+    except (CircuitOpen, httpx.HTTPError):
+        return None
+
+async def _seed_tracks(track_ids):
+    # Title/artist of liked tracks: the local model knows most, the db the rest
+    tracks = {tid: local_recommender().track(tid) for tid in track_ids}
+    missing = [tid for tid, t in tracks.items() if t is None]
+    if missing:
+        for tid, card in (await swipe_db.fetch_tracks(missing) or {}).items():
+            tracks[tid] = Track.from_card(card)
+    return [t for t in tracks.values() if t is not None and t.title and t.artist]
+
+async def _spotify_candidates(spotify_token, username, seed_ids, limit, excludes):
+    from fastapi import HTTPException
+    try:
+        remote = await get_spotify_recommendations_from_swipes(spotify_token, seed_ids, limit=50)
+    except (HTTPException, CircuitOpen, httpx.HTTPError) as e:
+        print("Spotify recs unavailable, using last known good candidates:", getattr(e, "detail", e))
+        breaker.mark_degraded("spotify")
+        yield last_good.store.draw(username, limit, excludes)
+        raise
+    last_good.store.keep(username, candidates=remote)
+    yield remote
+
+async def _lastfm_candidates(api_key, spotify_token, seed_ids):
+    seeds = await _seed_tracks(seed_ids[:LASTFM_SEEDS])
+    similar = await asyncio.gather(*(get_lastfm_similar_tracks(api_key, t.title, t.artist) for t in seeds))
+    # Best matches of every seed first, resolved concurrently, yielded as they resolve
+    pairs = [p for rank in zip_longest(*similar) for p in rank if p is not None]
+    tasks = [asyncio.ensure_future(_resolve_quietly(spotify_token, title, artist)) for title, artist in pairs]
+    try:
+        for done in asyncio.as_completed(tasks):
+            track = await done
+            if track is not None:
+                yield [track]
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _llm_candidates(openai_api_key, weather_api_key, spotify_token):
+    profile = await build_user_profile(spotify_token, weather_api_key)
+    client = make_openai_client(openai_api_key)
+    loop = asyncio.get_running_loop()
+    records = asyncio.Queue()
+    stop = threading.Event()
+
+    def produce():
+        # The OpenAI SDK is synchronous: stream in a worker thread and hand
+        # each record over as soon as its '---' separator arrives
+        if stop.is_set():
+            return
+        recs = stream_llm_recommendations(profile, client, stop=stop)
+        try:
+            for rec in recs:
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(records.put_nowait, rec)
+        finally:
+            recs.close()
+            if not stop.is_set():
+                loop.call_soon_threadsafe(records.put_nowait, None)
+
+    worker = loop.run_in_executor(_llm_executor, produce)
+    try:
+        while (rec := await records.get()) is not None:
+            track = await _resolve_quietly(spotify_token, rec.get("title"), rec.get("artist"))
+            if track is not None:
+                yield [track]
+        await worker  # re-raises what went wrong in the thread
+    finally:
+        # Cancelled or done early: the thread drops the stream at its next
+        # chunk, and whatever it raises then is of no interest any more
+        stop.set()
+        worker.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+def _sources_timeout():
+    left = remaining()
+    return SOURCES_MAX_S if left is None else max(0.0, left - TOPUP_RESERVE_S)
+
+async def get_recommendations_from_swipes(spotify_token, username, node_base_url="http://localhost:5000", limit=5, sync=True, exclude=(),
+                                          lastfm_api_key=None, openai_api_key=None, weather_api_key=None):
+    return [c async for c in iter_recommendations(
+        spotify_token, username, node_base_url, limit, sync, exclude, lastfm_api_key, openai_api_key, weather_api_key
+    )]
+
+async def iter_recommendations(spotify_token, username, node_base_url="http://localhost:5000", limit=5, sync=True, exclude=(),
+                               lastfm_api_key=None, openai_api_key=None, weather_api_key=None):
+    """
+    Async generator behind /recommend: yields each simplified track as soon as it
+    passes the already-swiped filter, deduplicated across sources, and stops at `limit`.
+    sync=False when the caller already synced the history (e.g. the batch endpoint).
+    exclude: track ids to skip even though they weren't swiped (e.g. already queued).
+    lastfm_api_key / openai_api_key add Last.fm and the LLM as candidate sources.
+    When Node or Spotify are down (or their circuit is open) it carries on with the
+    swipes we already have and the user's last known good candidates, and flags the
+    request as degraded.
+    """
+    # The starter pool serves both the no-likes case and the top-up, and doesn't
+    # depend on the swipe history -> warm it alongside the history fetch.
+    pool_task = asyncio.create_task(get_starter_pool(spotify_token))
+    failure = None
+    try:
+        # 1) Sync history (only swipes newer than what we already have)
+        if sync:
+            with timing.stage("swipe_sync"):
+                try:
+                    history = await sync_user_swipes(username, node_base_url)
+                except (CircuitOpen, httpx.HTTPError) as e:
+                    print("Swipe sync unavailable, using known swipes:", e)
+                    breaker.mark_degraded("node")
+                    history = swipe_store.get_user_swipes(username)
+        else:
+            history = swipe_store.get_user_swipes(username)
+        already = history.seen
+        picked = set()                # interned ids sent in this batch
+        excluded = intern_ids(exclude)
+
+        # 2) Local item-item recs from all of the user's swipes (no network);
+        #    the remote sources only when the local engine comes up short
+        with timing.stage("seeds"):
+            seed_ids = history.recent_likes()
+        if seed_ids:
+            with timing.stage("local_recs"):
+                local = CandidateSet(local_recommender().recommend(username, seen=already, n=50))
+            with timing.stage("filter"):
+                local = local.without(excluded)
+            for t in local:
+                picked.add(t.iid)
+                metrics.CANDIDATES.inc("local")
+                yield t.as_card()
+                if len(picked) >= limit:
+                    return
+
+            # 3) Every remote source at once, first good candidates win
+            sources = {
+                "spotify": _spotify_candidates(
+                    spotify_token, username, seed_ids, limit - len(picked), (picked, excluded, already)
+                ),
+            }
+            if lastfm_api_key:
+                sources["lastfm"] = _lastfm_candidates(lastfm_api_key, spotify_token, seed_ids)
+            if openai_api_key:
+                sources["llm"] = _llm_candidates(openai_api_key, weather_api_key, spotify_token)
+            errors = []
+            merged = fanout.merge(sources, timeout=_sources_timeout(), errors=errors)
+            try:
+                async for source, batch in merged:
+                    with timing.stage("filter"):
+                        batch = CandidateSet(batch).without(picked, excluded, already)
+                    for t in batch:
+                        picked.add(t.iid)
+                        metrics.CANDIDATES.inc(source)
+                        yield t.as_card()
+                        if len(picked) >= limit:
+                            return
+            finally:
+                await merged.aclose()
+            # Last.fm / LLM failures only cost candidates; Spotify's decides the answer
+            failure = dict(errors).get("spotify")
+
+        # 4) No likes yet, or not enough candidates -> top up from the starter pool
+        with timing.stage("starter_pool"):
+            pool = await pool_task
+            if pool:
+                last_good.store.keep(username, starter=pool)
+                topup = _sample_tracks(pool, limit - len(picked), excludes=(picked, excluded, already))
+            else:
+                # Library unavailable (Spotify down, expired token) -> last known good
+                topup = last_good.store.draw(username, limit - len(picked), (picked, excluded, already))
+                if topup:
+                    breaker.mark_degraded("spotify")
+        for t in topup:
+            picked.add(t.iid)
+            metrics.CANDIDATES.inc("starter_pool")
+            yield t.as_card()
+        if not picked and failure is not None:
+            raise failure
+    finally:
+        if not pool_task.done():
+            pool_task.cancel()
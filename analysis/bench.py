@@ -0,0 +1,317 @@
+# bench.py
+# Offline micro-benchmarks for the pure-Python hot paths of the recommender.
+# Every upstream (Spotify, Node) is replaced by an in-process httpx transport
+# serving synthetic data, so runs are repeatable and need no network or keys.
+#
+#   python bench.py                              # realistic scale, JSON to stdout
+#   python bench.py --scale extreme --out new.json
+#   python bench.py --compare old.json           # exit 1 if anything got slower
+#
+# Scales: "realistic" ~ an active user today, "extreme" = 10k-swipe history,
+# 500-candidate pools and a 50-song LLM answer.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Pacing and the backend db would only add noise here
+os.environ.setdefault("GOOSECHASE_DB_PATH", os.devnull)
+os.environ.setdefault("SPOTIFY_RPS", "1e9")
+os.environ.setdefault("PER_TOKEN_RPS", "1e9")
+# Fresh caches for every run (removed at exit): nothing carries over between
+# runs, and a bench on a production host never writes into the live ones
+_cache_dir = tempfile.TemporaryDirectory(prefix="goosechase-bench-")
+os.environ["SHARED_CACHE_PATH"] = os.path.join(_cache_dir.name, "shared_cache.sqlite")
+os.environ["LLM_CACHE_PATH"] = os.path.join(_cache_dir.name, "llm_cache.sqlite")
+
+import httpx
+
+import ChatxLastFMreccomends as recs
+import http_client
+import payloads
+import swipe_store
+from tracks import extract_track_id
+
+SCALES = {
+    "realistic": {"swipes": 1000, "candidates": 100, "llm_songs": 10, "library": 300},
+    "extreme": {"swipes": 10000, "candidates": 500, "llm_songs": 50, "library": 2000},
+}
+TOKEN = "bench-token"
+USERNAME = "bench-user"
+DEFAULT_THRESHOLD = 1.25  # --compare fails when median time grows by more than this factor
+
+
+# ----- synthetic data -----
+
+def _tid(i):
+    return "B%021d" % i
+
+
+def spotify_track(i):
+    return {
+        "id": _tid(i),
+        "name": f"Song {i}",
+        "artists": [{"name": f"Artist {i % 97}"}, {"name": "Guest"}],
+        "preview_url": f"https://p.scdn.co/mp3-preview/{i}",
+        "album": {"name": f"Album {i % 31}", "images": [{"url": f"https://i.scdn.co/image/{i}"}]},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{_tid(i)}"},
+    }
+
+
+def spotify_track_full(i):
+    """spotify_track() padded out to what the Web API really sends (decoding benchmarks)."""
+    t = spotify_track(i)
+    markets = ["AD", "AE", "AR", "AT", "AU", "BE", "BR", "CA", "CH", "DE", "ES", "FR", "GB", "IL", "IT", "JP", "US"] * 10
+    t.update(
+        type="track", uri=f"spotify:track:{_tid(i)}", href=f"https://api.spotify.com/v1/tracks/{_tid(i)}",
+        duration_ms=200000 + i, explicit=False, popularity=i % 100, track_number=1, disc_number=1,
+        is_local=False, external_ids={"isrc": f"XX{i:010d}"}, available_markets=markets,
+    )
+    t["artists"] = [dict(a, id=f"A{i}", type="artist", uri=f"spotify:artist:A{i}") for a in t["artists"]]
+    t["album"].update(
+        id=f"AL{i}", album_type="album", release_date="2020-01-01", total_tracks=12,
+        available_markets=markets, artists=t["artists"],
+        images=[{"url": f"https://i.scdn.co/image/{i}-{h}", "height": h, "width": h} for h in (640, 300, 64)],
+    )
+    return t
+
+
+def node_swipe(k):
+    return {
+        "id": k + 1,
+        "trackId": _tid(k),
+        "direction": "RIGHT" if k % 3 else "LEFT",
+        "track": {
+            "id": _tid(k),
+            "title": f"Song {k}",
+            "artist": f"Artist {k % 97}",
+            "imageUrl": None,
+            "previewUrl": None,
+            "spotifyUrl": f"https://open.spotify.com/track/{_tid(k)}",
+        },
+    }
+
+
+def llm_text(n):
+    blocks = []
+    for i in range(n):
+        blocks.append(
+            f"Title: Song {i}\nArtist: Artist {i % 97}\nSnippet Lyrics: la la la {i}\n"
+            f"Suggested Lyrics: words words {i}\nSuggested Lyrics Start Time: 0:{i % 60:02d}\n"
+            f"Suggested Lyrics End Time: 1:{i % 60:02d}\nReason: because {i}\n"
+        )
+    return "---\n".join(blocks)
+
+
+def id_inputs(n):
+    rng = random.Random(1)
+    out = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.4:
+            out.append(_tid(i))
+        elif kind < 0.9:
+            out.append(f"https://open.spotify.com/track/{_tid(i)}?si=abc{i}")
+        else:
+            out.append(f"not a track {i}")
+    return out
+
+
+class Upstreams:
+    """Canned Spotify/Node responses, encoded once so the transport costs ~nothing."""
+
+    def __init__(self, scale, candidates_seen):
+        n_swipes, n_cands, n_lib = scale["swipes"], scale["candidates"], scale["library"]
+        # Candidates overlap the swipe history by `candidates_seen`, so filtering has work to do
+        first = int(n_swipes - n_cands * candidates_seen)
+        self.recs = json.dumps({"tracks": [spotify_track(first + i) for i in range(n_cands)]}).encode()
+        self.swipes = json.dumps({"ok": True, "swipes": [node_swipe(k) for k in range(n_swipes)]}).encode()
+        self.library = [spotify_track(10_000_000 + i) for i in range(n_lib)]
+
+    def handler(self, request):
+        path = request.url.path
+        if path == "/v1/me":
+            return httpx.Response(200, json={"id": USERNAME})
+        if path == "/v1/recommendations":
+            return httpx.Response(200, content=self.recs, headers={"Content-Type": "application/json"})
+        if path == "/api/swipes":
+            return httpx.Response(200, content=self.swipes, headers={"Content-Type": "application/json"})
+        if path == "/v1/me/tracks":
+            off = int(request.url.params.get("offset", 0))
+            lim = int(request.url.params.get("limit", 50))
+            items = [{"track": t} for t in self.library[off:off + lim]]
+            return httpx.Response(200, json={"items": items, "total": len(self.library), "offset": off, "limit": lim})
+        return httpx.Response(404, json={})
+
+    def install(self):
+        http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+
+
+# ----- runner -----
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "median_us": round(statistics.median(samples) * 1e6, 2),
+        "p95_us": round(samples[int(0.95 * (len(samples) - 1))] * 1e6, 2),
+        "min_us": round(samples[0] * 1e6, 2),
+    }
+
+
+def _run_sync(fn, min_time, min_runs):
+    fn()  # warm-up
+    samples, start = [], time.perf_counter()
+    while len(samples) < min_runs or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+async def _run_async(fn, min_time, min_runs):
+    await fn()
+    samples, start = [], time.perf_counter()
+    while len(samples) < min_runs or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+async def run(scale_name, min_time=0.5, min_runs=5, only=None):
+    scale = SCALES[scale_name]
+    results = {}
+
+    def want(name):
+        return only is None or name in only
+
+    # Pure functions
+    text = llm_text(scale["llm_songs"])
+    chunks = [text[i:i + 40] for i in range(0, len(text), 40)]  # ~token-sized stream deltas
+    ids = id_inputs(scale["swipes"])
+    raw_tracks = [spotify_track(i) for i in range(scale["candidates"])]
+    recs_body = json.dumps({"tracks": [spotify_track_full(i) for i in range(scale["candidates"])]}).encode()
+
+    def parse_stream():
+        parser = recs.RecommendationStreamParser()
+        for c in chunks:
+            parser.feed(c)
+        parser.close()
+
+    sync_cases = {
+        "parse_text_recommendations": lambda: recs.parse_text_recommendations(text),
+        "parse_stream": parse_stream,
+        "extract_track_id": lambda: [extract_track_id(s) for s in ids],
+        "simplify_spotify_track": lambda: [recs._simplify_spotify_track(t) for t in raw_tracks],
+        # Full json decode + dict picking vs. payloads' lean decoder, same body
+        "decode_recommendations_dicts": lambda: [
+            recs._simplify_spotify_track(t) for t in json.loads(recs_body)["tracks"]
+        ],
+        "decode_recommendations": lambda: payloads.recommendation_tracks(recs_body),
+    }
+    for name, fn in sync_cases.items():
+        if want(name):
+            results[name] = _summary(_run_sync(fn, min_time, min_runs))
+
+    # Paths that go through (stubbed) upstreams
+    upstreams = Upstreams(scale, candidates_seen=0.9)
+    upstreams.install()
+
+    async def fetch_swipes():
+        await recs.fetch_user_swipes(USERNAME, "http://node.bench", limit=scale["swipes"])
+
+    async def ingest_swipes():
+        page = await recs.fetch_user_swipes(USERNAME, "http://node.bench", limit=scale["swipes"])
+        swipe_store.UserSwipes().add(page)
+
+    async_cases = {"fetch_user_swipes": fetch_swipes, "ingest_swipes": ingest_swipes}
+
+    # Recommendation filter/top-up over a full history (sync=False: history already local)
+    history = swipe_store.get_user_swipes(USERNAME)
+    history.add(await recs.fetch_user_swipes(USERNAME, "http://node.bench", limit=scale["swipes"]))
+    await recs.get_starter_pool(TOKEN)
+
+    async def recommend():
+        await recs.get_recommendations_from_swipes(TOKEN, USERNAME, "http://node.bench", limit=5, sync=False)
+
+    async def recommend_topup():
+        # Every remote candidate already swiped -> the whole batch comes from the starter pool
+        await recs.get_recommendations_from_swipes(TOKEN, USERNAME, "http://node.bench", limit=20, sync=False)
+
+    async_cases["recommend"] = recommend
+    for name, fn in async_cases.items():
+        if want(name):
+            results[name] = _summary(await _run_async(fn, min_time, min_runs))
+
+    if want("recommend_topup"):
+        saturated = Upstreams(scale, candidates_seen=1.0)
+        saturated.install()
+        results["recommend_topup"] = _summary(await _run_async(recommend_topup, min_time, min_runs))
+
+    await http_client.aclose()
+    return {
+        "meta": {
+            "scale": scale_name,
+            "params": scale,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(old, new, threshold):
+    """Print per-benchmark ratios; returns the names that regressed past `threshold`."""
+    regressed = []
+    for name, cur in new["results"].items():
+        base = old.get("results", {}).get(name)
+        if not base:
+            print(f"{name:32s} (new)  {cur['median_us']:>12.1f} us")
+            continue
+        ratio = cur["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:32s} {base['median_us']:>12.1f} -> {cur['median_us']:>12.1f} us  x{ratio:.2f}{flag}")
+        if flag:
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline micro-benchmarks for the recommender hot paths")
+    ap.add_argument("--scale", choices=sorted(SCALES), default="realistic")
+    ap.add_argument("--min-time", type=float, default=0.5, help="seconds per benchmark")
+    ap.add_argument("--only", nargs="*", help="benchmark names to run")
+    ap.add_argument("--out", help="write JSON results here instead of stdout")
+    ap.add_argument("--compare", help="baseline JSON from an earlier run")
+    ap.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = ap.parse_args(argv)
+
+    result = asyncio.run(run(args.scale, args.min_time, only=set(args.only) if args.only else None))
+    encoded = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(encoded + "\n")
+    elif not args.compare:
+        print(encoded)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("scale") != args.scale:
+            print(f"warning: baseline scale is {baseline.get('meta', {}).get('scale')!r}, not {args.scale!r}")
+        if compare(baseline, result, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# breaker.py
+# Circuit breakers, one per upstream (the names http_client uses: spotify,
+# spotify_auth, node, openai, weather, lastfm, ...).
+#
+# A breaker watches the outcomes of the last WINDOW calls. A call fails when
+# it errors, answers 429/5xx or takes longer than the upstream's SLOW_CALL_S.
+# Once MIN_CALLS have been seen and FAILURE_RATE of them failed, the breaker
+# opens: calls raise CircuitOpen at once instead of sitting out timeouts, and
+# the recommender answers from last-known-good data (last_good.py). After
+# OPEN_S a single probe call goes through (half-open); it closes the breaker
+# or opens it again.
+#
+# Requests that had to fall back are flagged: main.py opens a degraded set per
+# request (track_degraded) and code that served fallback data adds the
+# upstream to it (mark_degraded).
+#
+# CIRCUIT_BREAKERS=0 turns every breaker off (always closed).
+
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+ENABLED = os.getenv("CIRCUIT_BREAKERS", "1") != "0"
+WINDOW = 20          # most recent calls considered
+MIN_CALLS = 10       # don't judge an upstream on fewer calls than this
+FAILURE_RATE = 0.5   # share of failed calls in the window that opens the breaker
+OPEN_S = 15.0        # how long an open breaker rejects calls before probing
+
+# Calls slower than this count as failures even when they succeed
+SLOW_CALL_S = {
+    "spotify": 3.0,
+    "spotify_auth": 3.0,
+    "node": 2.0,
+    "weather": 3.0,
+    "lastfm": 3.0,
+    "openai": 30.0,
+}
+DEFAULT_SLOW_CALL_S = 5.0
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_degraded = contextvars.ContextVar("degraded_upstreams", default=None)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, upstream):
+        super().__init__(f"{upstream} circuit open")
+        self.upstream = upstream
+
+
+class CircuitBreaker:
+    def __init__(self, name, slow_call_s=DEFAULT_SLOW_CALL_S):
+        self.name = name
+        self.slow_call_s = slow_call_s
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._outcomes = deque(maxlen=WINDOW)  # True = failed
+        self._failures = 0
+        self._probing = False
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Whether a call may go out now (in half-open state: only the one probe)."""
+        if self.state == CLOSED or not ENABLED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= OPEN_S:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok, seconds):
+        """
+        Outcome of a call that allow() let through. ok=None means we gave up
+        on it ourselves (cancelled, out of budget): only counted if it was slow.
+        """
+        failed = ok is False or seconds > self.slow_call_s
+        if ok is None and not failed:
+            self._probing = False
+            return
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if failed:
+                self._open()
+            else:
+                self._close()
+            return
+        if len(self._outcomes) == WINDOW:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+        if self.state == CLOSED and len(self._outcomes) >= MIN_CALLS and self._failures >= FAILURE_RATE * len(self._outcomes):
+            self._open()
+
+    @contextmanager
+    def guard(self):
+        """`with breaker.guard(): call()` for calls that signal failure by raising (e.g. the OpenAI SDK)."""
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        start = time.monotonic()
+        ok = None
+        try:
+            yield
+            ok = True
+        except Exception:
+            ok = False
+            raise
+        finally:
+            self.record(ok, time.monotonic() - start)
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.opens += 1
+        print(f"Circuit open: {self.name} ({self._failures}/{len(self._outcomes)} recent calls failed)")
+
+    def _close(self):
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+    def is_open(self):
+        return ENABLED and self.state != CLOSED
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "open": self.is_open(),
+            "recent_calls": len(self._outcomes),
+            "recent_failures": self._failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+
+_breakers = {}
+
+
+def get(upstream):
+    breaker = _breakers.get(upstream)
+    if breaker is None:
+        breaker = _breakers[upstream] = CircuitBreaker(upstream, SLOW_CALL_S.get(upstream, DEFAULT_SLOW_CALL_S))
+    return breaker
+
+
+def is_open(upstream):
+    breaker = _breakers.get(upstream)
+    return breaker is not None and breaker.is_open()
+
+
+def stats():
+    return {name: b.stats() for name, b in _breakers.items()}
+
+
+def track_degraded():
+    """Start collecting for the current request; returns the set of upstreams it had to fall back for."""
+    upstreams = set()
+    _degraded.set(upstreams)
+    return upstreams
+
+
+def mark_degraded(upstream):
+    upstreams = _degraded.get()
+    if upstreams is not None:
+        upstreams.add(upstream)
+
+
+def degraded_upstreams():
+    """Upstreams the current request fell back for (empty set outside track_degraded)."""
+    return _degraded.get() or set()
@@ -0,0 +1,129 @@
+# catalog.py
+# Local index from free-text (title, artist) to a playable Track, so
+# LLM-sourced recommendations can usually be resolved in memory instead of
+# with a Spotify search per song.
+#
+# Keys are normalized (lowercased, "feat. X" and remaster/live suffixes
+# stripped, punctuation removed). Exact keys live in a dict; near misses fall
+# back to a trigram index over "title artist".
+#
+# Every user's saved library passes through here, so the index is an LRU
+# capped at MAX_ENTRIES: the least recently added/resolved key goes first,
+# together with its trigram postings.
+
+import re
+from collections import Counter, OrderedDict
+
+FUZZY_MIN_SIMILARITY = 0.7
+FUZZY_MAX_POSTINGS = 2000  # skip trigrams so common they don't discriminate
+MAX_ENTRIES = 50_000     # ~2.5KB each with postings
+
+_FEAT_RE = re.compile(r"[\(\[]?\s*\b(feat|ft|featuring)\b\.?\s+[^\)\]]*[\)\]]?", re.IGNORECASE)
+_SUFFIX_RE = re.compile(
+    r"\s*(-|\(|\[)\s*(\d{4}\s+)?(remaster(ed)?|live|radio edit|mono|stereo|single version|deluxe|acoustic version)\b.*$",
+    re.IGNORECASE,
+)
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_ARTIST_SPLIT_RE = re.compile(r"\s*(,|&|\bx\b|\band\b|\bfeat\b\.?|\bft\b\.?)\s*", re.IGNORECASE)
+
+
+def normalize_title(title):
+    t = _FEAT_RE.sub(" ", title or "")
+    t = _SUFFIX_RE.sub("", t)
+    t = _PUNCT_RE.sub(" ", t.lower())
+    return " ".join(t.split())
+
+
+def normalize_artist(artist):
+    # Primary artist only: "A feat. B" / "A & B" / "A, B" -> "a"
+    first = _ARTIST_SPLIT_RE.split(artist or "", maxsplit=1)[0]
+    return " ".join(_PUNCT_RE.sub(" ", first.lower()).split())
+
+
+def _trigrams(text):
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogIndex:
+    def __init__(self):
+        self._exact = OrderedDict()  # (title, artist) -> tracks.Track, least recently used first
+        self._postings = {}          # trigram -> set of keys
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._exact)
+
+    def add(self, track, title=None, artist=None):
+        """Index a Track under its own title/artist (or an alias, e.g. the LLM's spelling)."""
+        if track is None:
+            return
+        key = (normalize_title(title or track.title), normalize_artist(artist or track.artist))
+        if not key[0]:
+            return
+        if key in self._exact:
+            self._exact.move_to_end(key)
+            return
+        self._exact[key] = track
+        for g in _trigrams(f"{key[0]} {key[1]}"):
+            self._postings.setdefault(g, set()).add(key)
+        while len(self._exact) > MAX_ENTRIES:
+            self._evict()
+
+    def _evict(self):
+        key, _ = self._exact.popitem(last=False)
+        for g in _trigrams(f"{key[0]} {key[1]}"):
+            keys = self._postings.get(g)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[g]
+        self.evictions += 1
+
+    def resolve(self, title, artist):
+        """Track for (title, artist), or None."""
+        key = (normalize_title(title), normalize_artist(artist))
+        track = self._exact.get(key)
+        if track is not None:
+            self._exact.move_to_end(key)
+            self.exact_hits += 1
+            return track
+        best = self._fuzzy(key)
+        if best is not None:
+            self._exact.move_to_end(best)
+            self.fuzzy_hits += 1
+            return self._exact[best]
+        self.misses += 1
+        return None
+
+    def _fuzzy(self, key):
+        grams = _trigrams(f"{key[0]} {key[1]}")
+        counts = Counter()
+        for g in grams:
+            keys = self._postings.get(g)
+            if keys and len(keys) <= FUZZY_MAX_POSTINGS:
+                counts.update(keys)
+        best, best_sim = None, FUZZY_MIN_SIMILARITY
+        for other, shared in counts.most_common(20):
+            n_other = len(_trigrams(f"{other[0]} {other[1]}"))
+            sim = shared / (len(grams) + n_other - shared)
+            if sim >= best_sim:
+                best, best_sim = other, sim
+        return best
+
+    def stats(self):
+        return {
+            "entries": len(self._exact),
+            "max_entries": MAX_ENTRIES,
+            "postings": len(self._postings),
+            "evictions": self.evictions,
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+        }
+
+
+index = CatalogIndex()
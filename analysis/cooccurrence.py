@@ -0,0 +1,211 @@
+# cooccurrence.py
+# Local item-item recommender built from everyone's swipes.
+#
+# C[i, j] counts how many users liked both track i and track j (sparse CSR,
+# columns = interned ids from swipe_store). A user is scored with one sparse
+# mat-vec over *all* their likes (and, negatively, dislikes) using cosine
+# normalisation:  scores = D^-1/2 · C · D^-1/2 · u.  New swipes are buffered
+# as COO triplets and folded into C in batches, so updates stay incremental.
+# A user's new likes are paired in bulk (int32 arrays, one pair per like and
+# earlier like within MAX_LIKES_PER_USER), and the buffer is folded in once it
+# holds MAX_PENDING pairs, so a heavy history can't build up an unbounded batch.
+
+import time
+
+import numpy as np
+from scipy import sparse
+
+from swipe_store import interner
+from tracks import Track
+
+LEFT_WEIGHT = 0.5           # how strongly a LEFT swipe pushes similar tracks down
+MAX_LIKES_PER_USER = 500    # only the most recent likes form co-occurrence pairs
+FLUSH_EVERY = 5000          # pending pairs before they are folded into C
+FLUSH_INTERVAL_S = 10.0
+MAX_PENDING = 1_000_000     # pending pairs folded in right away, even mid-update
+
+
+class CooccurrenceModel:
+    def __init__(self):
+        self._C = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._likes_per_item = np.zeros(0, dtype=np.float32)
+        self._user_likes = {}     # user -> set of interned ids
+        self._recent_likes = {}   # user -> int32 array of the last MAX_LIKES_PER_USER likes
+        self._user_dislikes = {}  # user -> set of interned ids
+        self._meta = {}           # interned id -> Track
+        self._rows = []           # int32 arrays; each (row, col) pair is added both ways
+        self._cols = []
+        self._pending = 0         # matrix entries buffered in _rows/_cols (2 per pair)
+        self._last_flush = time.monotonic()
+
+    # ----- updates -----
+
+    def add_swipes(self, user, swipes):
+        """Feed normalized swipes (see fetch_user_swipes), oldest first."""
+        new_likes = []
+        for s in swipes:
+            tid = s.get("trackId")
+            if not tid:
+                continue
+            i = interner.intern(tid)
+            track = s.get("track") or {}
+            if track.get("title") and i not in self._meta:
+                self._meta[i] = Track(
+                    i,
+                    track.get("title"),
+                    track.get("artist"),
+                    track.get("previewUrl"),
+                    track.get("imageUrl"),
+                    track.get("spotifyUrl"),
+                )
+            if self._add(user, i, str(s.get("direction")).upper() == "RIGHT"):
+                new_likes.append(i)
+        self._pair(user, new_likes)
+
+    def add_columns(self, users, track_ids, liked):
+        """Feed swipes as parallel columns (user, track id, 1=RIGHT/0=LEFT)."""
+        new_likes = {}  # user -> new likes in order
+        for user, tid, like in zip(users, track_ids, liked):
+            i = interner.intern(tid)
+            if self._add(user, i, like):
+                new_likes.setdefault(user, []).append(i)
+        for user, ids in new_likes.items():
+            self._pair(user, ids)
+
+    def add_tracks(self, cards):
+        """Card metadata ({track id: card}) for tracks that came in without it."""
+        for tid, card in cards.items():
+            i = interner.intern(tid)
+            if i not in self._meta:
+                self._meta[i] = Track(i, card.get("title"), card.get("artist"), card.get("preview_url"),
+                                      card.get("image_url"), card.get("spotify_url"))
+
+    def missing_meta(self, track_ids):
+        return [t for t in set(track_ids) if interner.intern(t) not in self._meta]
+
+    def _add(self, user, i, like):
+        """Record one swipe; True for a like the user hadn't given before (still to be paired)."""
+        if not like:
+            self._user_dislikes.setdefault(user, set()).add(i)
+            return False
+        likes = self._user_likes.setdefault(user, set())
+        if i in likes:
+            return False
+        likes.add(i)
+        self._user_dislikes.get(user, set()).discard(i)
+        if i >= len(self._likes_per_item):
+            self._grow(i + 1)
+        self._likes_per_item[i] += 1
+        return True
+
+    def _pair(self, user, new_likes):
+        # Pair every new like with the (up to) MAX_LIKES_PER_USER likes before it
+        if not new_likes:
+            return
+        recent = self._recent_likes.get(user)
+        start = 0 if recent is None else len(recent)
+        seq = np.asarray(new_likes, dtype=np.int32)
+        if start:
+            seq = np.concatenate((recent, seq))
+        positions = np.arange(start, len(seq))
+        counts = np.minimum(positions, MAX_LIKES_PER_USER)
+        self._recent_likes[user] = seq[-MAX_LIKES_PER_USER:].copy()
+        # For position p: the likes at p - counts[p] .. p - 1
+        ends = np.cumsum(counts)
+        total = int(ends[-1])
+        if not total:
+            return
+        rows = np.repeat(seq[start:], counts)
+        earlier = np.repeat(positions - counts - (ends - counts), counts)
+        earlier += np.arange(total, dtype=earlier.dtype)
+        for lo in range(0, total, MAX_PENDING):
+            hi = min(total, lo + MAX_PENDING)
+            self._rows.append(rows[lo:hi])
+            self._cols.append(seq[earlier[lo:hi]])
+            self._pending += 2 * (hi - lo)
+            if self._pending >= 2 * MAX_PENDING:
+                self.flush(force=True)
+
+    def _grow(self, n):
+        n = max(n, 2 * len(self._likes_per_item))
+        counts = np.zeros(n, dtype=np.float32)
+        counts[: len(self._likes_per_item)] = self._likes_per_item
+        self._likes_per_item = counts
+
+    def flush(self, force=False):
+        if not self._rows:
+            return
+        if not force and self._pending < FLUSH_EVERY and time.monotonic() - self._last_flush < FLUSH_INTERVAL_S:
+            return
+        n = len(self._likes_per_item)
+        rows = np.concatenate(self._rows)
+        cols = np.concatenate(self._cols)
+        self._rows, self._cols = [], []
+        delta = sparse.coo_matrix(
+            (np.ones(2 * len(rows), dtype=np.float32), (np.concatenate((rows, cols)), np.concatenate((cols, rows)))),
+            shape=(n, n),
+        ).tocsr()
+        del rows, cols
+        C = self._C
+        if C.shape[0] < n:
+            C = C.copy()
+            C.resize((n, n))
+        self._C = (C + delta).tocsr()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    # ----- scoring -----
+
+    def score(self, user):
+        """Cosine co-occurrence score for every known track (dense float32 vector)."""
+        self.flush()
+        n = self._C.shape[0]
+        likes = self._user_likes.get(user)
+        if not likes or n == 0:
+            return np.zeros(0, dtype=np.float32)
+        u = np.zeros(n, dtype=np.float32)
+        u[[i for i in likes if i < n]] = 1.0
+        dislikes = [i for i in self._user_dislikes.get(user, ()) if i < n]
+        if dislikes:
+            u[dislikes] -= LEFT_WEIGHT
+        counts = self._likes_per_item[:n]
+        d = np.zeros(n, dtype=np.float32)
+        nz = counts > 0
+        d[nz] = 1.0 / np.sqrt(counts[nz])
+        return d * (self._C @ (d * u))
+
+    def recommend(self, user, seen=(), n=50):
+        """Top-n unseen Tracks for a user; [] when there is no signal."""
+        scores = self.score(user)
+        if not len(scores):
+            return []
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return []
+        top = candidates[np.argsort(-scores[candidates], kind="stable")]
+        out = []
+        for i in top:
+            i = int(i)
+            track = self._meta.get(i)
+            if track is None or i in seen:
+                continue
+            out.append(track)
+            if len(out) >= n:
+                break
+        return out
+
+    def track(self, track_id):
+        """Track metadata for a swiped track id, or None."""
+        i = interner.lookup(track_id)
+        return self._meta.get(i) if i is not None else None
+
+    def stats(self):
+        return {
+            "items": int(self._C.shape[0]),
+            "nnz": int(self._C.nnz),
+            "users": len(self._user_likes),
+            "pending_pairs": self._pending,
+        }
+
+
+model = CooccurrenceModel()
@@ -0,0 +1,69 @@
+# deadline.py
+# Per-request time budgets. The FastAPI handler sets a budget once, and every
+# upstream call underneath reads how much of it is left (see http_client).
+# When the budget runs out the whole request task is cancelled, which also
+# cancels any upstream calls still in flight.
+
+import asyncio
+import contextvars
+import time
+
+import timing
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def remaining(default: float | None = None) -> float | None:
+    """Seconds left in the current request budget (default if none is set)."""
+    d = _deadline.get()
+    if d is None:
+        return default
+    return max(0.0, d - time.monotonic())
+
+
+def spawn_detached(coro) -> asyncio.Task:
+    """create_task for background work that must not inherit the caller's request budget (or timings)."""
+    token = _deadline.set(None)
+    spans = timing.suspend()
+    try:
+        return asyncio.create_task(coro)
+    finally:
+        _deadline.reset(token)
+        timing.resume(spans)
+
+
+async def run_with_budget(coro, seconds: float):
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        return await asyncio.wait_for(coro, timeout=seconds)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"request budget of {seconds}s exceeded")
+    finally:
+        _deadline.reset(token)
+
+
+async def iter_with_budget(agen, seconds: float):
+    """Re-yield an async generator's items; stop it once the budget is spent."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        while True:
+            left = remaining(0.0)
+            if left <= 0:
+                raise DeadlineExceeded(f"request budget of {seconds}s exceeded")
+            try:
+                item = await asyncio.wait_for(agen.__anext__(), timeout=left)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"request budget of {seconds}s exceeded")
+            yield item
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            pass  # finalized from another context (client went away)
+        await agen.aclose()
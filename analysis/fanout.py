@@ -0,0 +1,54 @@
+# fanout.py
+# Run several async generators at once and take their items in arrival order.
+# iter_recommendations uses it to query every candidate source (Spotify,
+# Last.fm, the LLM) together: it stops reading as soon as it has enough, and
+# whatever is still running is cancelled. Sources inherit the request's
+# deadline like any other task; `timeout` cuts the fan-out shorter than that.
+
+import asyncio
+import time
+
+import timing
+
+_DONE = object()
+
+
+async def merge(sources, timeout=None, errors=None):
+    """
+    Async generator of (source name, item) over `sources` ({name: async
+    generator}) as items arrive. Ends when every source is done or after
+    `timeout` seconds; closing it early cancels the sources still running.
+    A source that raises simply ends; (name, exception) goes to `errors`.
+    """
+    queue = asyncio.Queue()
+
+    async def pump(name, agen):
+        try:
+            with timing.stage(f"{name}_recs"):
+                async for item in agen:
+                    queue.put_nowait((name, item))
+        except Exception as e:
+            if errors is not None:
+                errors.append((name, e))
+        finally:
+            queue.put_nowait((name, _DONE))
+
+    tasks = [asyncio.create_task(pump(name, agen)) for name, agen in sources.items()]
+    end = None if timeout is None else time.monotonic() + timeout
+    running = len(tasks)
+    try:
+        while running:
+            left = None if end is None else end - time.monotonic()
+            if left is not None and left <= 0:
+                return
+            try:
+                name, item = await asyncio.wait_for(queue.get(), left)
+            except asyncio.TimeoutError:
+                return
+            if item is _DONE:
+                running -= 1
+            else:
+                yield name, item
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,299 @@
+# http_client.py
+# One shared async HTTP client for every upstream call (Spotify, Node, weather).
+# Connections are kept alive and pooled, so repeated calls to the same host
+# skip the TCP+TLS handshake. HTTP/2 is used when the optional `h2` package
+# is installed (pip install httpx[http2]).
+#
+# Requests are paced per host/token (see ratelimit.py). 429s and transient
+# 5xx/transport errors are retried with jittered exponential backoff, but only
+# while the request budget allows it; otherwise the last response is returned
+# as is. Slow GETs can optionally be hedged with a second copy.
+#
+# Every call goes through its upstream's circuit breaker (breaker.py): while
+# it is open, request() raises breaker.CircuitOpen without touching the network.
+# The breaker judges the upstream by the time spent on the wire only: waiting
+# for our own pacing, a connection slot or a retry backoff is not its fault.
+#
+# UPSTREAM_OVERRIDES points hosts elsewhere (load tests, local stand-ins):
+#   UPSTREAM_OVERRIDES="api.spotify.com=http://127.0.0.1:9100,api.openweathermap.org=http://127.0.0.1:9100"
+
+import asyncio
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+import breaker
+import deadline
+import metrics
+import ratelimit
+import timing
+
+try:
+    import h2  # noqa: F401
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+# Pool sizing (whole process)
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 40
+KEEPALIVE_EXPIRY = 30.0
+
+# Max concurrent in-flight requests to a single host
+PER_HOST_LIMIT = 20
+
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+# Retries
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+MAX_ATTEMPTS = 3
+BACKOFF_BASE_S = 0.2
+BACKOFF_MAX_S = 4.0
+
+# Hedging: if a GET hasn't answered after this many seconds, send a second
+# copy (only when the rate limiter has a free slot) and take whichever wins.
+# 0 disables it.
+HEDGE_AFTER_S = float(os.getenv("HTTP_HEDGE_AFTER_S", "0"))
+
+stats = {"retries": 0, "hedges": 0, "hedge_wins": 0}
+
+# Stage names for Server-Timing (other hosts are reported as "upstream")
+UPSTREAM_STAGES = {
+    "api.spotify.com": "spotify",
+    "accounts.spotify.com": "spotify_auth",
+    "api.openweathermap.org": "weather",
+    "ws.audioscrobbler.com": "lastfm",
+    "api.openai.com": "openai",
+}
+
+
+def _parse_overrides(value):
+    out = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            host, base = item.split("=", 1)
+            out[host.strip()] = base.strip().rstrip("/")
+    return out
+
+
+UPSTREAM_OVERRIDES = _parse_overrides(os.getenv("UPSTREAM_OVERRIDES"))
+
+
+def _route(url: str) -> str:
+    parts = urlsplit(url)
+    base = UPSTREAM_OVERRIDES.get(parts.netloc)
+    if base is None:
+        return url
+    return base + parts.path + ("?" + parts.query if parts.query else "")
+
+_client: httpx.AsyncClient | None = None
+_host_slots: dict[str, asyncio.Semaphore] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=DEFAULT_TIMEOUT,
+        )
+    return _client
+
+
+def _host_slot(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    slot = _host_slots.get(host)
+    if slot is None:
+        slot = _host_slots[host] = asyncio.Semaphore(PER_HOST_LIMIT)
+    return slot
+
+
+def _backoff(attempt: int) -> float:
+    # "Full jitter": uniform over [0, base * 2^attempt], so retries don't line up
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+
+
+def _fits(wait: float) -> bool:
+    left = deadline.remaining()
+    return left is None or wait < left
+
+
+async def _wait_turn(host: str, token_key, background: bool = False):
+    if background:
+        # Own smaller budget first, then only a slot foreground calls leave free
+        await asyncio.sleep(ratelimit.limiter.reserve_background(host))
+        while not ratelimit.limiter.try_reserve(host, token_key):
+            if not _fits(ratelimit.BACKGROUND_POLL_S):
+                raise deadline.DeadlineExceeded(f"no background slot on {host}")
+            await asyncio.sleep(ratelimit.BACKGROUND_POLL_S)
+        return
+    delay, release = ratelimit.limiter.reserve(host, token_key)
+    if delay > 0:
+        if not _fits(delay):
+            release()
+            raise deadline.DeadlineExceeded(f"rate limited on {host} for {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+class _WireClock:
+    """Longest single send of a call, from the moment it got a connection slot."""
+    __slots__ = ("longest", "_since")
+
+    def __init__(self):
+        self.longest = 0.0
+        self._since = None
+
+    def start(self):
+        if self._since is None:
+            self._since = time.perf_counter()
+
+    def stop(self):
+        if self._since is not None:
+            self.longest = max(self.longest, time.perf_counter() - self._since)
+            self._since = None
+
+    def seconds(self):
+        self.stop()  # still sending (cancelled mid-call) counts up to now
+        return self.longest
+
+
+async def _send(method: str, url: str, clock: _WireClock | None = None, **kwargs) -> httpx.Response:
+    # Never wait on an upstream longer than the request budget allows
+    left = deadline.remaining()
+    if left is not None:
+        if left <= 0:
+            raise deadline.DeadlineExceeded(f"no budget left for {method} {url}")
+        timeout = kwargs.get("timeout")
+        if timeout is None or isinstance(timeout, httpx.Timeout) or timeout > left:
+            kwargs["timeout"] = left
+    async with _host_slot(url):
+        if clock is not None:
+            clock.start()
+        return await get_client().request(method, url, **kwargs)
+
+
+async def _send_hedged(method, url, host, token_key, hedge_after, clock, **kwargs) -> httpx.Response:
+    # The first copy's time is what the breaker sees: hedging covers for it
+    first = asyncio.ensure_future(_send(method, url, clock, **kwargs))
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done or not ratelimit.limiter.try_reserve(host, token_key):
+        return await first
+    stats["hedges"] += 1
+    second = asyncio.ensure_future(_send(method, url, **kwargs))
+    pending = {first, second}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None or not pending:
+                    if task is second:
+                        stats["hedge_wins"] += 1
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def request(
+    method: str, url: str, hedge_after: float | None = None, upstream: str | None = None,
+    background: bool = False, **kwargs
+) -> httpx.Response:
+    """
+    `upstream` names the service for stages, metrics and its breaker (default: by host).
+    background=True paces the call behind foreground traffic (see ratelimit.py).
+    """
+    upstream = upstream or UPSTREAM_STAGES.get(urlsplit(url).netloc, "upstream")
+    circuit = breaker.get(upstream)
+    if not circuit.allow():
+        metrics.UPSTREAM_RESPONSES.inc(upstream, "circuit_open")
+        raise breaker.CircuitOpen(upstream)
+    start = time.perf_counter()
+    clock = _WireClock()
+    ok = None
+    try:
+        with timing.stage(upstream):
+            response = await _request(method, url, hedge_after, upstream, clock, background, **kwargs)
+        ok = response.status_code not in RETRY_STATUSES
+        return response
+    except httpx.HTTPError:
+        ok = False
+        raise
+    finally:
+        circuit.record(ok, clock.seconds())
+        metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream)
+
+
+async def _request(
+    method: str, url: str, hedge_after: float | None, upstream: str, clock: _WireClock, background: bool,
+    **kwargs
+) -> httpx.Response:
+    # Pacing/stage names use the real host; the request itself may be re-routed
+    host = urlsplit(url).netloc
+    url = _route(url) if UPSTREAM_OVERRIDES else url
+    token_key = ratelimit.token_key(kwargs.get("headers"))
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    if hedge_after is None:
+        hedge_after = HEDGE_AFTER_S
+    attempt = 0
+    while True:
+        attempt += 1
+        await _wait_turn(host, token_key, background)
+        try:
+            if idempotent and hedge_after > 0:
+                response = await _send_hedged(method, url, host, token_key, hedge_after, clock, **kwargs)
+            else:
+                response = await _send(method, url, clock, **kwargs)
+        except httpx.TransportError:
+            clock.stop()
+            metrics.UPSTREAM_RESPONSES.inc(upstream, "error")
+            wait = _backoff(attempt)
+            if not idempotent or attempt >= MAX_ATTEMPTS or not _fits(wait):
+                raise
+            stats["retries"] += 1
+            await asyncio.sleep(wait)
+            continue
+
+        clock.stop()
+        status = response.status_code
+        metrics.UPSTREAM_RESPONSES.inc(upstream, status)
+        if status not in RETRY_STATUSES:
+            return response
+        retry_after = ratelimit.parse_retry_after(response.headers.get("Retry-After"))
+        blocked = retry_after is not None and status in (429, 503)
+        if blocked:
+            ratelimit.limiter.block(host, retry_after)
+        # A 429 was never processed, so it is safe to resend whatever the method
+        if attempt >= MAX_ATTEMPTS or not (idempotent or status == 429):
+            return response
+        wait = max(retry_after or 0.0, _backoff(attempt))
+        if not _fits(wait):
+            return response
+        stats["retries"] += 1
+        await response.aclose()
+        # The limiter holds the wait for Retry-After blocks; sleep only the backoff here
+        await asyncio.sleep(0 if blocked else wait)
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_slots.clear()
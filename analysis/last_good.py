@@ -0,0 +1,115 @@
+# last_good.py
+# Last-known-good candidates per user, served while an upstream is down or
+# its circuit is open (breaker.py). Every Spotify recommendation batch and
+# starter pool a user got is remembered here; in degraded mode the recommender
+# draws from them instead, filtered against the user's swipes exactly like
+# fresh candidates, so the answer is immediate and never repeats a swipe.
+#
+# Kept per process, with a snapshot in shared_cache (written at most every
+# SHARE_EVERY_S per user) so any worker can fall back for the user.
+# Nothing older than MAX_AGE_S is served.
+
+import json
+import random
+import time
+from collections import OrderedDict
+
+import shared_cache
+from tracks import Track, CandidateSet
+
+MAX_AGE_S = 6 * 3600
+SHARE_EVERY_S = 60
+MAX_USERS = 10000
+
+
+def _shared_key(username):
+    return "last-good:" + username
+
+
+class _Pools:
+    __slots__ = ("candidates", "starter", "updated_at", "shared_at")
+
+    def __init__(self, candidates=(), starter=(), updated_at=0.0):
+        self.candidates = list(candidates)
+        self.starter = list(starter)
+        self.updated_at = updated_at
+        self.shared_at = 0.0
+
+
+class LastGood:
+    def __init__(self):
+        self._users = OrderedDict()
+        self.served = 0
+        self.misses = 0
+
+    def keep(self, username, candidates=None, starter=None):
+        """Remember a successful batch of Spotify candidates and/or the user's starter pool."""
+        if not username or not (candidates or starter):
+            return
+        pools = self._users.get(username)
+        if pools is None:
+            pools = self._add(username, _Pools())
+        else:
+            self._users.move_to_end(username)
+        if candidates:
+            pools.candidates = list(candidates)
+        if starter:
+            pools.starter = list(starter)
+        pools.updated_at = time.time()
+        if pools.updated_at - pools.shared_at >= SHARE_EVERY_S:
+            pools.shared_at = pools.updated_at
+            snapshot = {
+                "candidates": [t.as_card() for t in pools.candidates],
+                "starter": [t.as_card() for t in pools.starter],
+                "updated_at": pools.updated_at,
+            }
+            shared_cache.put(_shared_key(username), json.dumps(snapshot), MAX_AGE_S)
+
+    def _add(self, username, pools):
+        self._users[username] = pools
+        while len(self._users) > MAX_USERS:
+            self._users.popitem(last=False)
+        return pools
+
+    def _get(self, username):
+        pools = self._users.get(username)
+        if pools is None:
+            shared = shared_cache.get(_shared_key(username))
+            if shared is not None:
+                snapshot = json.loads(shared[0])
+                pools = self._add(username, _Pools(
+                    filter(None, map(Track.from_card, snapshot["candidates"])),
+                    filter(None, map(Track.from_card, snapshot["starter"])),
+                    snapshot["updated_at"],
+                ))
+        else:
+            self._users.move_to_end(username)
+        if pools is None or time.time() - pools.updated_at > MAX_AGE_S:
+            return None
+        return pools
+
+    def draw(self, username, limit, excludes=()):
+        """
+        Up to `limit` remembered tracks minus `excludes` (see CandidateSet.without):
+        the last candidates in their original order, then random starter tracks.
+        """
+        pools = self._get(username) if username and limit > 0 else None
+        if pools is None:
+            self.misses += 1
+            return []
+        out = CandidateSet(pools.candidates).without(*excludes).tracks[:limit]
+        if len(out) < limit:
+            taken = {t.iid for t in out}
+            starter = CandidateSet(pools.starter).without(taken, *excludes).tracks
+            out += random.sample(starter, min(limit - len(out), len(starter)))
+        if out:
+            self.served += 1
+        else:
+            self.misses += 1
+        return out
+
+    def stats(self):
+        return {"users": len(self._users), "served": self.served, "misses": self.misses}
+
+
+store = LastGood()
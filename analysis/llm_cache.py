@@ -0,0 +1,155 @@
+# llm_cache.py
+# Persistent cache for chat-completion responses (SQLite file next to this module,
+# or LLM_CACHE_PATH). Keyed by a hash of the normalized (model, system message,
+# prompt, temperature), with a TTL and a size cap (least recently used go first).
+#
+# Near-duplicate lookup: a prompt that differs from a recent one by a trivial
+# line (e.g. one extra liked lyric) can reuse that answer. Prompts are compared
+# line by line, restricted to the same model/system/temperature *and owner*:
+# near-duplicates are only looked up when the caller names one (a user or
+# session id), so a personalised answer is never handed to someone else.
+# Exact hits are shared, since the prompt is identical.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import breaker
+
+DB_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), ".llm_cache.sqlite"))
+TTL_S = 7 * 24 * 3600
+MAX_BYTES = 50 * 1024 * 1024
+
+NEAR_DUP_WINDOW_S = 24 * 3600
+NEAR_DUP_MAX_LINE_DIFF = 2   # lines added + removed (one changed line = 2)
+NEAR_DUP_MIN_JACCARD = 0.8
+NEAR_DUP_CANDIDATES = 200
+
+_conn = None
+_lock = threading.Lock()
+
+stats = {"hits": 0, "near_hits": 0, "misses": 0, "saved_latency_s": 0.0}
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, scope TEXT NOT NULL, n_lines INTEGER NOT NULL,"
+            " lines TEXT NOT NULL, response TEXT NOT NULL, latency_s REAL NOT NULL,"
+            " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_scope ON llm_cache (scope, n_lines, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+        _conn = conn
+    return _conn
+
+
+def _norm(text):
+    # Whitespace-insensitive: strip each line, collapse runs of spaces, drop blank lines
+    return [" ".join(line.split()) for line in (text or "").splitlines() if line.strip()]
+
+
+def _h(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _split(model, messages, temperature, owner=None):
+    system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    prompt = "\n".join(m["content"] for m in messages if m["role"] != "system")
+    shared = [model, _norm(system), round(float(temperature), 2)]
+    lines = _norm(prompt)
+    key = _h(json.dumps([_h(json.dumps(shared)), lines]))
+    scope = _h(json.dumps(shared + [owner]))
+    return key, scope, lines
+
+
+def lookup(model, messages, temperature, near_duplicates=False, owner=None):
+    """Cached response text, or None. Near-duplicates only count within the same `owner`."""
+    key, scope, lines = _split(model, messages, temperature, owner)
+    now = time.time()
+    with _lock:
+        db = _db()
+        row = db.execute(
+            "SELECT response, latency_s, key FROM llm_cache WHERE key = ? AND created_at > ?",
+            (key, now - TTL_S),
+        ).fetchone()
+        if row is None and near_duplicates and owner is not None:
+            row = _near_duplicate(db, scope, lines, now)
+            if row is not None:
+                stats["near_hits"] += 1
+        if row is None:
+            stats["misses"] += 1
+            return None
+        db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, row[2]))
+        db.commit()
+    stats["hits"] += 1
+    stats["saved_latency_s"] += row[1]
+    return row[0]
+
+
+def _near_duplicate(db, scope, lines, now):
+    wanted = set(lines)
+    rows = db.execute(
+        "SELECT response, latency_s, key, lines FROM llm_cache"
+        " WHERE scope = ? AND n_lines BETWEEN ? AND ? AND created_at > ?"
+        " ORDER BY created_at DESC LIMIT ?",
+        (scope, len(lines) - NEAR_DUP_MAX_LINE_DIFF, len(lines) + NEAR_DUP_MAX_LINE_DIFF,
+         now - NEAR_DUP_WINDOW_S, NEAR_DUP_CANDIDATES),
+    ).fetchall()
+    for response, latency_s, key, stored in rows:
+        other = set(json.loads(stored))
+        union = wanted | other
+        if not union:
+            continue
+        if len(wanted ^ other) <= NEAR_DUP_MAX_LINE_DIFF and len(wanted & other) / len(union) >= NEAR_DUP_MIN_JACCARD:
+            return response, latency_s, key
+    return None
+
+
+def store(model, messages, temperature, response, latency_s, owner=None):
+    key, scope, lines = _split(model, messages, temperature, owner)
+    encoded = json.dumps(lines)
+    size = len(encoded) + len(response)
+    now = time.time()
+    with _lock:
+        db = _db()
+        db.execute(
+            "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, scope, len(lines), encoded, response, latency_s, size, now, now),
+        )
+        db.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - TTL_S,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total > MAX_BYTES:
+            # Drop least recently used entries until we're back under the cap
+            freed = 0
+            for old_key, old_size in db.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall():
+                if total - freed <= MAX_BYTES:
+                    break
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (old_key,))
+                freed += old_size
+        db.commit()
+
+
+def cached_chat_completion(openai_client, model, messages, temperature, near_duplicates=False, owner=None):
+    """chat.completions.create(...).choices[0].message.content, served from the cache when possible."""
+    cached = lookup(model, messages, temperature, near_duplicates, owner)
+    if cached is not None:
+        return cached
+    start = time.monotonic()
+    with breaker.get("openai").guard():
+        response = openai_client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+    text = response.choices[0].message.content
+    store(model, messages, temperature, text, time.monotonic() - start, owner)
+    return text
+
+
+def get_stats():
+    lookups = stats["hits"] + stats["misses"]
+    return dict(stats, hit_rate=round(stats["hits"] / lookups, 4) if lookups else 0.0)
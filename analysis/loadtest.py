@@ -0,0 +1,500 @@
+# loadtest.py
+# End-to-end load generator for main.py with local stand-in upstreams.
+#
+# Starts a stub server that imitates the Spotify Web API endpoints we call,
+# the Node /api/swipes endpoint, OpenWeatherMap and OpenAI chat completions
+# (with configurable latency and error rates), starts the app under uvicorn
+# pointed at it (UPSTREAM_OVERRIDES / NODE_BASE_URL / OPENAI_BASE_URL), drives
+# /recommend and /get-starting-songs, and reports throughput and p50/p95/p99
+# latency overall and per stage (from the app's Server-Timing header).
+#
+#   python loadtest.py --concurrency 50 --duration 30
+#   python loadtest.py --rate 200 --duration 30 --workers 4 --out report.json
+#   python loadtest.py --stub-latency-ms 150 --stub-error-rate 0.02 --stub-429-rate 0.01
+#   python loadtest.py --app-env PREFETCH_BATCHES=0 --app-env WEATHER_TTL_S=0
+#   python loadtest.py --target http://127.0.0.1:8000   # app already running
+#
+# Requires nothing beyond the app's own dependencies (httpx, starlette, uvicorn).
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUB_HOSTS = ("api.spotify.com", "accounts.spotify.com", "api.openweathermap.org", "ws.audioscrobbler.com")
+_TIMING_RE = re.compile(r"([A-Za-z0-9_]+);dur=([0-9.]+)")
+
+
+# =============================================================================
+# Stub upstreams
+# =============================================================================
+
+def _tid(i):
+    return "L%021d" % i
+
+
+def _track(i):
+    return {
+        "id": _tid(i),
+        "name": f"Song {i}",
+        "artists": [{"name": f"Artist {i % 311}"}],
+        "preview_url": f"https://p.scdn.co/mp3-preview/{i}",
+        "album": {"name": f"Album {i % 97}", "images": [{"url": f"https://i.scdn.co/image/{i}"}]},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{_tid(i)}"},
+    }
+
+
+def _user_index(name):
+    # "tok-17" / "user-17" -> 17; anything else hashes to a stable index
+    tail = name.rsplit("-", 1)[-1]
+    return int(tail) if tail.isdigit() else int(hashlib.sha256(name.encode()).hexdigest()[:8], 16)
+
+
+def _llm_text(n):
+    return "---\n".join(
+        f"Title: Song {i}\nArtist: Artist {i % 311}\nSnippet Lyrics: la la {i}\nReason: stub\n" for i in range(n)
+    )
+
+
+def make_stub_app(args):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+
+    rng = random.Random(args.seed)
+    catalog_size = args.stub_catalog
+    median_s = args.stub_latency_ms / 1000.0
+
+    async def upstream_delay():
+        if median_s > 0:
+            await asyncio.sleep(rng.lognormvariate(math.log(median_s), args.stub_latency_sigma))
+
+    def injected_error():
+        r = rng.random()
+        if r < args.stub_429_rate:
+            return JSONResponse({"error": {"status": 429}}, status_code=429, headers={"Retry-After": "1"})
+        if r < args.stub_429_rate + args.stub_error_rate:
+            return JSONResponse({"error": {"status": 500}}, status_code=500)
+        return None
+
+    def endpoint(fn):
+        async def handler(request):
+            await upstream_delay()
+            return injected_error() or await fn(request)
+        return handler
+
+    def _token_user(request):
+        auth = request.headers.get("Authorization", "")
+        return _user_index(auth.split(" ", 1)[-1])
+
+    async def me(request):
+        u = _token_user(request)
+        return JSONResponse({"id": f"user-{u}", "display_name": f"User {u}", "country": "IL", "product": "premium"})
+
+    async def top_tracks(request):
+        u = _token_user(request)
+        limit = int(request.query_params.get("limit", 20))
+        return JSONResponse({"items": [_track((u * 7 + i) % catalog_size) for i in range(limit)]})
+
+    async def recently_played(request):
+        u = _token_user(request)
+        limit = int(request.query_params.get("limit", 20))
+        return JSONResponse({"items": [{"track": _track((u * 13 + i) % catalog_size)} for i in range(limit)]})
+
+    async def saved_tracks(request):
+        u = _token_user(request)
+        off = int(request.query_params.get("offset", 0))
+        limit = int(request.query_params.get("limit", 20))
+        total = args.stub_library
+        items = [{"track": _track((u * 31 + i) % catalog_size)} for i in range(off, min(off + limit, total))]
+        return JSONResponse({"items": items, "total": total, "offset": off, "limit": limit, "next": None})
+
+    async def recommendations(request):
+        limit = int(request.query_params.get("limit", 20))
+        return JSONResponse({"tracks": [_track(rng.randrange(catalog_size)) for _ in range(limit)]})
+
+    async def search(request):
+        return JSONResponse({"tracks": {"items": [_track(rng.randrange(catalog_size))]}})
+
+    async def swipes(request):
+        # Same contract as backend/src/routes/recommendations/swipes.ts
+        u = _user_index(request.query_params.get("username", ""))
+        limit = min(int(request.query_params.get("limit", 50)), 200)
+        after = request.query_params.get("afterId")
+        history = args.stub_swipes
+        base = u * 1_000_000
+        ids = range(1, history + 1)
+        if after is not None:
+            ids = [k for k in ids if base + k > int(after)][:limit]
+        else:
+            ids = list(reversed(ids))[:limit]
+        rows = []
+        for k in ids:
+            t = _track((u * 17 + k) % catalog_size)
+            rows.append({
+                "id": base + k,
+                "trackId": t["id"],
+                "direction": "RIGHT" if (u + k) % 3 else "LEFT",
+                "track": {"id": t["id"], "title": t["name"], "artist": t["artists"][0]["name"],
+                          "imageUrl": None, "previewUrl": None, "spotifyUrl": t["external_urls"]["spotify"]},
+            })
+        return JSONResponse({"ok": True, "swipes": rows})
+
+    async def weather(request):
+        return JSONResponse({"weather": [{"description": "clear sky"}], "main": {"temp": 24.0}})
+
+    async def chat_completions(request):
+        body = await request.json()
+        text = _llm_text(args.stub_llm_songs)
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        async def events():
+            for i in range(0, len(text), 24):
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+                         "choices": [{"index": 0, "delta": {"content": text[i:i + 24]}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(args.stub_token_delay_ms / 1000.0)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def healthz(request):
+        return Response("ok")
+
+    return Starlette(routes=[
+        Route("/healthz", healthz),
+        Route("/v1/me", endpoint(me)),
+        Route("/v1/me/top/tracks", endpoint(top_tracks)),
+        Route("/v1/me/player/recently-played", endpoint(recently_played)),
+        Route("/v1/me/tracks", endpoint(saved_tracks)),
+        Route("/v1/recommendations", endpoint(recommendations)),
+        Route("/v1/search", endpoint(search)),
+        Route("/api/swipes", endpoint(swipes)),
+        Route("/data/2.5/weather", endpoint(weather)),
+        Route("/v1/chat/completions", endpoint(chat_completions), methods=["POST"]),
+    ])
+
+
+def run_stub(args):
+    import uvicorn
+    uvicorn.run(make_stub_app(args), host="127.0.0.1", port=args.stub_port, log_level="warning")
+
+
+# =============================================================================
+# Process management
+# =============================================================================
+
+def _stub_argv(args):
+    argv = [sys.executable, os.path.abspath(__file__), "stub", "--stub-port", str(args.stub_port), "--seed", str(args.seed)]
+    for name in ("stub_latency_ms", "stub_latency_sigma", "stub_error_rate", "stub_429_rate", "stub_catalog",
+                 "stub_library", "stub_swipes", "stub_llm_songs", "stub_token_delay_ms"):
+        argv += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    return argv
+
+
+def _app_env(args, tmpdir):
+    stub = f"http://127.0.0.1:{args.stub_port}"
+    env = dict(os.environ)
+    env.update({
+        "UPSTREAM_OVERRIDES": ",".join(f"{h}={stub}" for h in STUB_HOSTS),
+        "NODE_BASE_URL": stub,
+        "OPENAI_BASE_URL": stub + "/v1",
+        "OPENAI_API_KEY": "stub",
+        "GOOSECHASE_DB_PATH": os.path.join(tmpdir, "no-backend.db"),
+        "LLM_CACHE_PATH": os.path.join(tmpdir, "llm_cache.sqlite"),
+        "SHARED_CACHE_PATH": os.path.join(tmpdir, "shared_cache.sqlite"),
+    })
+    if not args.keep_rate_limits:
+        # Client-side pacing is tuned for the real Spotify; the stub has no limits
+        env.update({"SPOTIFY_RPS": "1e9", "PER_TOKEN_RPS": "1e9"})
+    for item in args.app_env or []:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def _wait_ready(url, method="GET", timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                r = await client.request(method, url, timeout=1.0)
+                if r.status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+# =============================================================================
+# Load driver
+# =============================================================================
+
+class Recorder:
+    def __init__(self, warmup_until):
+        self.warmup_until = warmup_until
+        self.samples = {}   # endpoint -> [latency_s]
+        self.statuses = {}  # endpoint -> {status: count}
+        self.stages = {}    # endpoint -> {stage: [seconds]}
+        self.started = None
+        self.finished = None
+
+    def add(self, endpoint, status, latency, server_timing):
+        now = time.monotonic()
+        if now < self.warmup_until:
+            return
+        if self.started is None:
+            self.started = now - latency
+        self.finished = now
+        self.samples.setdefault(endpoint, []).append(latency)
+        counts = self.statuses.setdefault(endpoint, {})
+        counts[status] = counts.get(status, 0) + 1
+        stages = self.stages.setdefault(endpoint, {})
+        for name, ms in _TIMING_RE.findall(server_timing or ""):
+            stages.setdefault(name, []).append(float(ms) / 1000.0)
+
+
+def _pick_endpoint(mix, rng):
+    r = rng.random()
+    for name, cumulative in mix:
+        if r <= cumulative:
+            return name
+    return mix[-1][0]
+
+
+def _parse_mix(value):
+    weights = {}
+    for item in value.split(","):
+        name, _, w = item.partition("=")
+        weights[name.strip()] = float(w or 1)
+    total = sum(weights.values())
+    out, acc = [], 0.0
+    for name, w in weights.items():
+        acc += w / total
+        out.append((name, acc))
+    return out
+
+
+async def _one(client, target, endpoint, user, recorder):
+    if endpoint == "recommend":
+        path, body = "/recommend", {"spotify_token": f"tok-{user}", "username": f"user-{user}"}
+    elif endpoint == "starting-songs":
+        path, body = "/get-starting-songs", {"accessToken": f"tok-{user}"}
+    else:
+        raise ValueError(f"unknown endpoint {endpoint!r}")
+    start = time.perf_counter()
+    try:
+        r = await client.post(target + path, json=body)
+        status, timing = r.status_code, r.headers.get("Server-Timing")
+    except httpx.HTTPError as e:
+        status, timing = type(e).__name__, None
+    recorder.add(endpoint, status, time.perf_counter() - start, timing)
+
+
+async def drive(args, target):
+    rng = random.Random(args.seed)
+    mix = _parse_mix(args.endpoint)
+    end = time.monotonic() + args.warmup + args.duration
+    recorder = Recorder(time.monotonic() + args.warmup)
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.max_in_flight))
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        if args.rate:
+            # Open loop: Poisson arrivals at --rate, whatever the latency
+            in_flight = set()
+            next_at = time.monotonic()
+            while time.monotonic() < end:
+                next_at += rng.expovariate(args.rate)
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+                if len(in_flight) >= args.max_in_flight:
+                    recorder.add("dropped", "client_overload", 0.0, None)
+                    continue
+                task = asyncio.create_task(
+                    _one(client, target, _pick_endpoint(mix, rng), rng.randrange(args.users), recorder)
+                )
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            if in_flight:
+                await asyncio.wait(in_flight)
+        else:
+            # Closed loop: --concurrency virtual users, each sending back to back
+            async def user_loop():
+                while time.monotonic() < end:
+                    await _one(client, target, _pick_endpoint(mix, rng), rng.randrange(args.users), recorder)
+
+            await asyncio.gather(*(user_loop() for _ in range(args.concurrency)))
+    return recorder
+
+
+# =============================================================================
+# Report
+# =============================================================================
+
+def _pct(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def _latency(values):
+    values = sorted(values)
+    return {
+        "p50_ms": round(_pct(values, 0.50) * 1000, 2),
+        "p95_ms": round(_pct(values, 0.95) * 1000, 2),
+        "p99_ms": round(_pct(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def report(args, recorder):
+    elapsed = (recorder.finished - recorder.started) if recorder.started is not None else 0.0
+    endpoints = {}
+    for endpoint, samples in recorder.samples.items():
+        if endpoint == "dropped":
+            continue
+        statuses = recorder.statuses.get(endpoint, {})
+        ok = statuses.get(200, 0)
+        endpoints[endpoint] = {
+            "requests": len(samples),
+            "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+            "success_rate": round(ok / len(samples), 4),
+            "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+            "latency": _latency(samples),
+            "stages": {
+                name: dict(_latency(values), share=round(len(values) / len(samples), 3))
+                for name, values in sorted(recorder.stages.get(endpoint, {}).items())
+            },
+        }
+    return {
+        "config": {
+            "mode": f"open loop @ {args.rate} req/s" if args.rate else f"closed loop x{args.concurrency}",
+            "duration_s": args.duration,
+            "workers": args.workers,
+            "users": args.users,
+            "endpoint_mix": args.endpoint,
+            "stub": {
+                "latency_ms": args.stub_latency_ms,
+                "latency_sigma": args.stub_latency_sigma,
+                "error_rate": args.stub_error_rate,
+                "429_rate": args.stub_429_rate,
+            },
+            "app_env": args.app_env or [],
+        },
+        "elapsed_s": round(elapsed, 2),
+        "dropped": len(recorder.samples.get("dropped", [])),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(result):
+    print(f"{result['config']['mode']}, {result['elapsed_s']}s measured, workers={result['config']['workers']}")
+    for endpoint, r in result["endpoints"].items():
+        lat = r["latency"]
+        print(f"\n{endpoint}: {r['requests']} req, {r['throughput_rps']} req/s, "
+              f"ok {r['success_rate']:.1%}, statuses {r['statuses']}")
+        print(f"  {'stage':20s} {'p50':>9s} {'p95':>9s} {'p99':>9s}  share")
+        print(f"  {'(end to end)':20s} {lat['p50_ms']:9.1f} {lat['p95_ms']:9.1f} {lat['p99_ms']:9.1f}")
+        for name, s in r["stages"].items():
+            print(f"  {name:20s} {s['p50_ms']:9.1f} {s['p95_ms']:9.1f} {s['p99_ms']:9.1f}  {s['share']:.0%}")
+    if result["dropped"]:
+        print(f"\n{result['dropped']} arrivals dropped (more than --max-in-flight outstanding)")
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def _add_stub_args(ap):
+    ap.add_argument("--stub-port", type=int, default=9100)
+    ap.add_argument("--stub-latency-ms", type=float, default=60.0, help="median upstream latency (0 = none)")
+    ap.add_argument("--stub-latency-sigma", type=float, default=0.5, help="lognormal spread of upstream latency")
+    ap.add_argument("--stub-error-rate", type=float, default=0.0, help="fraction of upstream calls answering 500")
+    ap.add_argument("--stub-429-rate", type=float, default=0.0, help="fraction answering 429 + Retry-After: 1")
+    ap.add_argument("--stub-catalog", type=int, default=20000, help="distinct tracks the stub knows")
+    ap.add_argument("--stub-library", type=int, default=300, help="saved tracks per user")
+    ap.add_argument("--stub-swipes", type=int, default=400, help="swipe history per user")
+    ap.add_argument("--stub-llm-songs", type=int, default=10)
+    ap.add_argument("--stub-token-delay-ms", type=float, default=5.0, help="delay between streamed LLM chunks")
+    ap.add_argument("--seed", type=int, default=1)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["stub"]:
+        ap = argparse.ArgumentParser(prog="loadtest.py stub")
+        _add_stub_args(ap)
+        run_stub(ap.parse_args(argv[1:]))
+        return 0
+
+    ap = argparse.ArgumentParser(description="Load-test main.py against local stand-in upstreams")
+    ap.add_argument("--concurrency", type=int, default=20, help="closed-loop virtual users")
+    ap.add_argument("--rate", type=float, default=0.0, help="open-loop requests/s (overrides --concurrency)")
+    ap.add_argument("--max-in-flight", type=int, default=1000, help="open loop: drop arrivals beyond this")
+    ap.add_argument("--duration", type=float, default=20.0)
+    ap.add_argument("--warmup", type=float, default=3.0, help="seconds excluded from the report")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--users", type=int, default=200, help="distinct synthetic users")
+    ap.add_argument("--endpoint", default="recommend=3,starting-songs=1",
+                    help="weighted mix, e.g. 'recommend' or 'recommend=3,starting-songs=1'")
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the app")
+    ap.add_argument("--app-port", type=int, default=8765)
+    ap.add_argument("--app-env", action="append", metavar="KEY=VALUE", help="extra env for the app (repeatable)")
+    ap.add_argument("--keep-rate-limits", action="store_true", help="keep the app's Spotify pacing against the stub")
+    ap.add_argument("--target", help="base URL of an already running app (no app process is started)")
+    ap.add_argument("--no-stub", action="store_true", help="don't start the stub (it is already running)")
+    ap.add_argument("--out", help="also write the JSON report here")
+    _add_stub_args(ap)
+    args = ap.parse_args(argv)
+
+    procs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            if not args.no_stub:
+                procs.append(subprocess.Popen(_stub_argv(args), cwd=HERE))
+                asyncio.run(_wait_ready(f"http://127.0.0.1:{args.stub_port}/healthz"))
+            target = args.target
+            if not target:
+                target = f"http://127.0.0.1:{args.app_port}"
+                procs.append(subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port),
+                     "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+                    cwd=HERE, env=_app_env(args, tmpdir),
+                ))
+                asyncio.run(_wait_ready(target + "/ready"))
+            recorder = asyncio.run(drive(args, target.rstrip("/")))
+        finally:
+            for p in reversed(procs):
+                p.terminate()
+            for p in procs:
+                try:
+                    p.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    p.kill()
+
+    result = report(args, recorder)
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,147 @@
 # main.py
 
+import asyncio
+import os
+import time
+from contextlib import aclosing, asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
 from ChatxLastFMreccomends import get_recommendations_from_swipes
-from ChatxLastFMreccomends import get_spotify_starting_songs
+from ChatxLastFMreccomends import draw_starting_songs
+from ChatxLastFMreccomends import local_recommender, warm_local_recommender, warm_catalog
+from ChatxLastFMreccomends import sync_many_user_swipes, sync_or_keep_swipes
+from ChatxLastFMreccomends import iter_recommendations, iter_starting_songs
 from typing import Optional, List
+import breaker
+import http_client
+import last_good
+import ratelimit
+import response_cache
+import llm_cache
+import catalog
+import weather_cache
+import prefetch
+import metrics
+import payloads
+import shared_cache
+import spotify_tokens
+import timing
+from singleflight import SingleFlight
+from deadline import run_with_budget, iter_with_budget, DeadlineExceeded
+from breaker import CircuitOpen
 
-app = FastAPI()
+# orjson-encoded responses when orjson is installed (much faster than json.dumps)
+if payloads.orjson is not None:
+    from fastapi.responses import ORJSONResponse as JSONResponse
+else:
+    from fastapi.responses import JSONResponse
+
+# Optional brotli (pip install brotli-asgi); gzip otherwise
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+# Per-request time budgets (seconds). Upstream calls still running when the
+# budget is spent are cancelled and the client gets a 504.
+RECOMMEND_BUDGET_S = 8.0
+STARTING_SONGS_BUDGET_S = 5.0
+BATCH_BUDGET_S = 60.0
+
+NODE_BASE_URL = os.getenv("NODE_BASE_URL", "http://localhost:5000")  # your Node server
+LASTFM_API_KEY = os.getenv("LASTFM_API_KEY")  # enables Last.fm candidates for every request
+RECOMMEND_LIMIT = 5
+COMPRESS_MIN_BYTES = 1000  # smaller bodies aren't worth compressing
+
+# Concurrent identical requests (client retries, several tabs) share one computation
+recommend_flight = SingleFlight()
+starting_songs_flight = SingleFlight()
+
+# Warm-up: everything a worker should have before it takes traffic. It runs
+# in the background from the lifespan, so the worker answers right away, and
+# /ready says 503 until it has finished: route traffic on /ready, not on the
+# port being open. Requests that arrive earlier are served, just cold.
+warmup_state = {"ready": False, "seconds": None, "swipes": 0, "catalog_tracks": 0}
+
+async def warm_up():
+    start = time.perf_counter()
+    # Connection pool (and HTTP/2 setup) before the first request needs it
+    http_client.get_client()
+    # numpy/scipy import off the loop, then the local recommender and the
+    # track catalog from the backend db (if it is reachable)
+    await asyncio.to_thread(local_recommender)
+    warmup_state["swipes"] = await warm_local_recommender()
+    warmup_state["catalog_tracks"] = await warm_catalog()
+    warmup_state.update(ready=True, seconds=round(time.perf_counter() - start, 3))
+
+async def _warm_up_in_background():
+    try:
+        await warm_up()
+    except Exception as e:
+        print("Warm-up failed, serving cold:", e)
+        warmup_state.update(ready=True, error=str(e))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmer = asyncio.create_task(_warm_up_in_background())
+    # Keeps active users' Spotify tokens refreshed ahead of expiry
+    token_refresher = asyncio.create_task(spotify_tokens.manager.run())
+    yield
+    warmer.cancel()
+    token_refresher.cancel()
+    # Close the pooled upstream connections on shutdown, finish queued shared-cache writes
+    await http_client.aclose()
+    await asyncio.to_thread(shared_cache.flush)
+
+app = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
+
+# Compresses regular responses. Streams are left alone so every line still
+# reaches the client as soon as it is produced.
+class Compression:
+    def __init__(self, app):
+        self.app = app
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, minimum_size=COMPRESS_MIN_BYTES, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=COMPRESS_MIN_BYTES)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].endswith("/stream"):
+            await self.compressed(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+app.add_middleware(Compression)
+
+# Request metrics for /metrics, plus per-stage timings as a Server-Timing
+# header on sampled requests (see timing.py; loadtest.py reads it). Answers
+# that had to fall back for a failing upstream carry X-Degraded.
+@app.middleware("http")
+async def instrument(request, call_next):
+    spans = timing.begin(metrics.should_sample())
+    degraded = breaker.track_degraded()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.REQUEST_SECONDS.observe(elapsed, path, request.method)
+        metrics.RESPONSES.inc(path, status)
+    if spans is not None:
+        response.headers["Server-Timing"] = timing.server_timing(spans, elapsed)
+    if degraded:
+        response.headers["X-Degraded"] = ",".join(sorted(degraded))
+    return response
+
+# Every upstream we needed is down and there was nothing to fall back on
+def _unavailable(e: CircuitOpen):
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(breaker.OPEN_S))})
 
 class RecommendRequest(BaseModel):
     spotify_token: str
@@ -19,24 +153,216 @@ class RecommendRequest(BaseModel):
 class DiscoverRequest(BaseModel):
     accessToken: str
 
+class BatchRecommendRequest(BaseModel):
+    users: List[RecommendRequest]
+
+# Every Spotify call gets the user's managed token (refreshed ahead of
+# expiry); callers we have no tokens for keep using the one they sent
+def _spotify_token(req: RecommendRequest):
+    return spotify_tokens.manager.resolve(req.spotify_token, req.username)
+
+# Extra candidate sources queried alongside Spotify: Last.fm with a key from
+# the request or LASTFM_API_KEY, the LLM when the request brings an OpenAI key
+def _source_keys(req: RecommendRequest):
+    return {
+        "lastfm_api_key": req.lastfm_api_key or LASTFM_API_KEY,
+        "openai_api_key": req.openai_api_key,
+        "weather_api_key": req.weather_api_key,
+    }
+
+# Coalesced per user *and* token: a batch is built from the caller's own
+# library, so callers without a username (or with another token) never share one
+def _recommend_for(req: RecommendRequest, spotify_token, sync=True):
+    def compute():
+        return get_recommendations_from_swipes(
+            spotify_token=spotify_token,
+            username=req.username,
+            node_base_url=NODE_BASE_URL,
+            limit=RECOMMEND_LIMIT,
+            sync=sync,
+            **_source_keys(req),
+        )
+
+    if req.username is None:
+        return compute()
+    return recommend_flight.do((req.username, spotify_token, RECOMMEND_LIMIT), compute)
+
 @app.post("/recommend")
-def recommend_songs(req: RecommendRequest):
+async def recommend_songs(req: RecommendRequest):
     try:
-        songs = get_recommendations_from_swipes(
-            spotify_token=req.spotify_token,
-            username=req.username,
-            node_base_url="http://localhost:5000",  # your Node server
-            limit=5,
+        with timing.stage("spotify_token"):
+            spotify_token = await run_with_budget(_spotify_token(req), RECOMMEND_BUDGET_S)
+        if req.username is None:
+            # No user to keep a prefetch queue for
+            songs = await run_with_budget(_recommend_for(req, spotify_token), RECOMMEND_BUDGET_S)
+            return {"recommendations": songs, "degraded": bool(breaker.degraded_upstreams())}
+        # Swipes since the last refill must not be served again from the queue
+        with timing.stage("swipe_sync"):
+            await run_with_budget(sync_or_keep_swipes(req.username, NODE_BASE_URL), RECOMMEND_BUDGET_S)
+        # Serve from the prefetch queue built with this caller's token when it
+        # holds a full batch
+        with timing.stage("prefetch"):
+            songs = prefetch.queues.take(req.username, spotify_token, RECOMMEND_LIMIT)
+        if songs is None:
+            songs = await run_with_budget(_recommend_for(req, spotify_token, sync=False), RECOMMEND_BUDGET_S)
+            prefetch.queues.mark_served(req.username, spotify_token, songs)
+        # ...and compute the next batches while the user swipes this one
+        prefetch.queues.refill(
+            req.username,
+            spotify_token,
+            RECOMMEND_LIMIT,
+            lambda n, exclude: get_recommendations_from_swipes(
+                spotify_token=spotify_token,
+                username=req.username,
+                node_base_url=NODE_BASE_URL,
+                limit=n,
+                exclude=exclude,
+                **_source_keys(req),
+            ),
         )
-        return {"recommendations": songs}
+        return {"recommendations": songs, "degraded": bool(breaker.degraded_upstreams())}
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except CircuitOpen as e:
+        raise _unavailable(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/get-starting-songs")
-def get_starting_songs(req: DiscoverRequest):
+async def get_starting_songs(req: DiscoverRequest):
+    try:
+        access_token = await run_with_budget(spotify_tokens.manager.resolve(req.accessToken), STARTING_SONGS_BUDGET_S)
+        songs, complete = await run_with_budget(
+            starting_songs_flight.do(access_token, lambda: draw_starting_songs(access_token)),
+            STARTING_SONGS_BUDGET_S,
+        )
+        # Drawn before the library walk finished: only the most recent saves
+        # were in the pool. Calls after the walk draw from the whole library.
+        return JSONResponse(content=songs, headers={"X-Starter-Pool": "complete" if complete else "partial"})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except CircuitOpen as e:
+        raise _unavailable(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Streaming variants: one track per line as soon as it's ready, so the client
+# can show the first card before the slowest source finishes.
+#   ?format=ndjson (default) -> application/x-ndjson
+#   ?format=sse              -> text/event-stream, ends with an "end" event
+def _stream(agen, budget_s, fmt):
+    async def body():
+        try:
+            async for track in iter_with_budget(agen, budget_s):
+                line = payloads.dumps(track).decode()
+                yield f"data: {line}\n\n" if fmt == "sse" else line + "\n"
+        except Exception as e:
+            # Headers are already sent -> report the error in-band and close
+            err = payloads.dumps({"error": str(e)}).decode()
+            yield f"event: error\ndata: {err}\n\n" if fmt == "sse" else err + "\n"
+            return
+        if fmt == "sse":
+            yield "event: end\ndata: {}\n\n"
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+# The token is resolved inside the streamed generator, so a slow or failing
+# refresh counts against the budget and is reported in-band like any error
+async def _recommendations(req: RecommendRequest):
+    spotify_token = await _spotify_token(req)
+    tracks = iter_recommendations(spotify_token, req.username, NODE_BASE_URL, RECOMMEND_LIMIT, **_source_keys(req))
+    async with aclosing(tracks) as agen:
+        async for track in agen:
+            yield track
+
+async def _starting_songs(req: DiscoverRequest):
+    access_token = await spotify_tokens.manager.resolve(req.accessToken)
+    async with aclosing(iter_starting_songs(access_token)) as agen:
+        async for track in agen:
+            yield track
+
+@app.post("/recommend/stream")
+async def recommend_songs_stream(req: RecommendRequest, format: str = "ndjson"):
+    return _stream(_recommendations(req), RECOMMEND_BUDGET_S, format)
+
+@app.post("/get-starting-songs/stream")
+async def get_starting_songs_stream(req: DiscoverRequest, format: str = "ndjson"):
+    return _stream(_starting_songs(req), STARTING_SONGS_BUDGET_S, format)
+
+# Many users at once (nightly pre-warm jobs): one pooled swipe sync for all
+# of them, then the per-user pipelines run concurrently.
+@app.post("/recommend/batch")
+async def recommend_batch(req: BatchRecommendRequest):
+    async def run():
+        tokens, _ = await asyncio.gather(
+            asyncio.gather(*(_spotify_token(u) for u in req.users)),
+            sync_many_user_swipes([u.username for u in req.users], NODE_BASE_URL),
+        )
+        return await asyncio.gather(
+            *(_recommend_for(u, token, sync=False) for u, token in zip(req.users, tokens)), return_exceptions=True
+        )
+
     try:
-        songs = get_spotify_starting_songs(req.accessToken)
-        print("Starting songs:", songs)
-        return JSONResponse(content=songs)
+        results = await run_with_budget(run(), BATCH_BUDGET_S)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except CircuitOpen as e:
+        raise _unavailable(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    out = []
+    for u, songs in zip(req.users, results):
+        if isinstance(songs, Exception):
+            out.append({"username": u.username, "error": str(songs)})
+        else:
+            out.append({"username": u.username, "recommendations": songs})
+    return {"results": out}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "spotify": response_cache.stats(),
+        "prefetch": prefetch.queues.stats(),
+        "llm": llm_cache.get_stats(),
+        "catalog": catalog.index.stats(),
+        "weather": weather_cache.cache.stats(),
+        "shared": shared_cache.get_stats(),
+        "spotify_tokens": spotify_tokens.manager.stats(),
+        "last_good": last_good.store.stats(),
+        "breakers": breaker.stats(),
+        "upstream": dict(ratelimit.limiter.stats(), **http_client.stats),
+        "local_recommender": local_recommender().stats(),
+        "in_flight": {
+            "recommend": recommend_flight.in_flight(),
+            "starting_songs": starting_songs_flight.in_flight(),
+        },
+    }
+
+# Cache/queue sizes and hit counters as gauges (read at scrape time)
+metrics.GaugeCallback(
+    "goosechase_cache", "Cache, queue and in-flight gauges (same numbers as /cache/stats)",
+    ("section", "field"), lambda: metrics.flatten_stats(cache_stats()),
+)
+metrics.GaugeCallback(
+    "goosechase_circuit_open", "1 while an upstream's circuit breaker is open (or probing)",
+    ("upstream",), lambda: {(name,): int(b["open"]) for name, b in breaker.stats().items()},
+)
+
+@app.get("/healthz")
+def healthz():
+    return {"ok": True}
+
+@app.get("/ready")
+def ready():
+    return JSONResponse(content=warmup_state, status_code=200 if warmup_state["ready"] else 503)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
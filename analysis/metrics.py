@@ -0,0 +1,146 @@
+# metrics.py
+# Minimal Prometheus-style metrics (text exposition format, no extra dependency).
+# Histograms and counters are plain dicts keyed by label values; gauges are
+# read from callbacks only when /metrics is scraped, so they cost nothing on
+# the request path.
+#
+# Sampling: per-stage spans (timing.py) are only collected for a sampled share
+# of requests. METRICS_SAMPLE_RATE sets the share (0..1) and
+# METRICS_MAX_SAMPLED_RPS caps how many requests per second are sampled, so
+# under peak load the overhead stays flat. Counters and upstream/request
+# latency histograms are always recorded.
+
+import bisect
+import os
+import random
+import time
+
+from ratelimit import TokenBucket
+
+SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+MAX_SAMPLED_RPS = float(os.getenv("METRICS_MAX_SAMPLED_RPS", "50"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_sample_bucket = TokenBucket(MAX_SAMPLED_RPS, max(1, int(MAX_SAMPLED_RPS))) if MAX_SAMPLED_RPS > 0 else None
+
+
+def should_sample():
+    """Whether to collect stage spans for the request that is starting."""
+    if SAMPLE_RATE <= 0 or (SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE):
+        return False
+    if _sample_bucket is not None:
+        now = time.monotonic()
+        if not _sample_bucket.available(now):
+            return False
+        _sample_bucket.reserve(now)
+    return True
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ("le",)
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class GaugeCallback:
+    """Gauges computed at scrape time: fn() -> {(label values...): number}."""
+
+    def __init__(self, name, help, labelnames, fn):
+        self.name, self.help, self.labelnames, self.fn = name, help, tuple(labelnames), fn
+        _registry.append(self)
+
+    def render(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            print("Metrics collector failed:", self.name, e)
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def flatten_stats(sections):
+    """{section: {field: number}} (e.g. /cache/stats) -> {(section, field): number}, numbers only."""
+    out = {}
+    for section, fields in sections.items():
+        for field, value in (fields or {}).items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                out[(section, field)] = value
+    return out
+
+
+# ----- metrics recorded across the service -----
+
+REQUEST_SECONDS = Histogram("goosechase_request_seconds", "HTTP request latency by route", ("route", "method"))
+RESPONSES = Counter("goosechase_responses_total", "HTTP responses by route and status", ("route", "status"))
+STAGE_SECONDS = Histogram("goosechase_stage_seconds", "Time spent per pipeline stage (sampled requests)", ("stage",))
+UPSTREAM_SECONDS = Histogram(
+    "goosechase_upstream_seconds", "Upstream call latency, including retries", ("upstream",)
+)
+UPSTREAM_RESPONSES = Counter(
+    "goosechase_upstream_responses_total", "Upstream responses by status (every attempt)", ("upstream", "status")
+)
+CANDIDATES = Counter(
+    "goosechase_candidates_total", "Recommendations served by candidate source", ("source",)
+)
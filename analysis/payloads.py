@@ -0,0 +1,149 @@
+# payloads.py
+# Lean JSON in and out.
+#
+# A Spotify track object carries the full album (every image size, release
+# info), all artists, markets, external ids, ... and a Track keeps six fields
+# of it. With msgspec installed, Spotify track payloads are decoded straight
+# into small structs that declare only those fields: the parser skips the
+# rest without building any Python objects for it. Without msgspec (or if a
+# body doesn't match the expected shape) the whole body is decoded and
+# Track.from_spotify picks the fields, as before.
+#
+# loads()/dumps() use orjson when it is installed, json otherwise.
+
+import json
+
+from swipe_store import interner
+from tracks import Track, extract_track_id
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def dumps(value):
+    """JSON as bytes."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+class TrackPage:
+    """A page of Tracks plus the paging fields we follow (saved tracks)."""
+    __slots__ = ("tracks", "total", "next")
+
+    def __init__(self, tracks, total=None, next=None):
+        self.tracks = tracks
+        self.total = total
+        self.next = next
+
+
+def _from_dicts(tracks):
+    return [t for t in map(Track.from_spotify, tracks) if t is not None]
+
+
+if msgspec is not None:
+    class _Artist(msgspec.Struct):
+        name: str | None = None
+
+    class _Image(msgspec.Struct):
+        url: str | None = None
+
+    class _Album(msgspec.Struct):
+        images: list[_Image] = []
+
+    class _Urls(msgspec.Struct):
+        spotify: str | None = None
+
+    class _Track(msgspec.Struct):
+        id: str | None = None
+        name: str | None = None
+        artists: list[_Artist] = []
+        preview_url: str | None = None
+        album: _Album | None = None
+        external_urls: _Urls | None = None
+
+    class _SavedItem(msgspec.Struct):
+        track: _Track | None = None
+
+    class _Recommendations(msgspec.Struct):
+        tracks: list[_Track | None] = []
+
+    class _SavedPage(msgspec.Struct):
+        items: list[_SavedItem] = []
+        total: int | None = None
+        next: str | None = None
+
+    class _SearchTracks(msgspec.Struct):
+        items: list[_Track | None] = []
+
+    class _Search(msgspec.Struct):
+        tracks: _SearchTracks | None = None
+
+    _decoders = {
+        shape: msgspec.json.Decoder(shape) for shape in (_Recommendations, _SavedPage, _Search)
+    }
+
+    def _track(t):
+        if t is None:
+            return None
+        url = t.external_urls.spotify if t.external_urls is not None else None
+        tid = t.id or extract_track_id(url)
+        if not tid:
+            return None
+        images = t.album.images if t.album is not None else ()
+        return Track(
+            interner.intern(tid),
+            t.name,
+            t.artists[0].name if t.artists else None,
+            t.preview_url,
+            images[0].url if images else None,
+            url,
+        )
+
+    def _decode(shape, body):
+        try:
+            return _decoders[shape].decode(body)
+        except msgspec.ValidationError:
+            return None  # unexpected shape -> full decode below
+else:
+    _Recommendations = _SavedPage = _Search = None
+
+    def _decode(shape, body):
+        return None
+
+
+def recommendation_tracks(body):
+    """Tracks of a /v1/recommendations response body."""
+    data = _decode(_Recommendations, body)
+    if data is not None:
+        return [t for t in map(_track, data.tracks) if t is not None]
+    return _from_dicts((loads(body) or {}).get("tracks") or [])
+
+
+def search_tracks(body):
+    """Tracks of a /v1/search?type=track response body."""
+    data = _decode(_Search, body)
+    if data is not None:
+        return [t for t in map(_track, data.tracks.items if data.tracks else ()) if t is not None]
+    return _from_dicts(((loads(body) or {}).get("tracks") or {}).get("items") or [])
+
+
+def saved_tracks_page(body):
+    """TrackPage for a /v1/me/tracks response body."""
+    data = _decode(_SavedPage, body)
+    if data is not None:
+        return TrackPage([t for t in (_track(item.track) for item in data.items) if t is not None], data.total, data.next)
+    data = loads(body) or {}
+    tracks = _from_dicts(item["track"] for item in data.get("items") or [] if item.get("track"))
+    return TrackPage(tracks, data.get("total"), data.get("next"))
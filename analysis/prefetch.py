@@ -0,0 +1,131 @@
+# prefetch.py
+# Per-user queue of precomputed recommendation cards. After a batch is served
+# the next one or two are computed in the background, so the following
+# /recommend can be answered straight from memory.
+#
+# A queue belongs to a username *and* the Spotify token it was built with
+# (the cards come from that account's library): another caller naming the
+# same user gets their own queue, never these cards. Callers sync the user's
+# swipes before take(), so tracks swiped since the refill aren't served again.
+#
+# Bounds (env-overridable): cards queued per user, how long queued cards stay
+# valid, and how many users keep a queue at all (LRU).
+
+import hashlib
+import os
+import time
+from collections import OrderedDict, deque
+
+import swipe_store
+from deadline import run_with_budget, spawn_detached
+
+PREFETCH_BATCHES = int(os.getenv("PREFETCH_BATCHES", "2"))
+MAX_QUEUED_CARDS = int(os.getenv("PREFETCH_MAX_CARDS", "20"))
+QUEUE_TTL_S = float(os.getenv("PREFETCH_TTL_S", "600"))
+MAX_USERS = int(os.getenv("PREFETCH_MAX_USERS", "5000"))
+REFILL_BUDGET_S = 15.0
+MAX_SERVED_IDS = 500  # recently served ids per user, never queued again
+
+
+def _key(username, spotify_token):
+    return username, hashlib.sha256((spotify_token or "").encode()).hexdigest()[:32]
+
+
+class _UserQueue:
+    __slots__ = ("cards", "filled_at", "task", "served", "served_order")
+
+    def __init__(self):
+        self.cards = deque()
+        self.filled_at = 0.0
+        self.task = None
+        self.served = set()
+        self.served_order = deque()
+
+    def mark_served(self, cards):
+        for c in cards:
+            tid = c.get("id")
+            if tid and tid not in self.served:
+                self.served.add(tid)
+                self.served_order.append(tid)
+        while len(self.served_order) > MAX_SERVED_IDS:
+            self.served.discard(self.served_order.popleft())
+
+
+class PrefetchQueues:
+    def __init__(self):
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0  # queued cards discarded as stale or already swiped
+
+    def _queue(self, username, spotify_token):
+        key = _key(username, spotify_token)
+        q = self._users.get(key)
+        if q is None:
+            q = self._users[key] = _UserQueue()
+            while len(self._users) > MAX_USERS:
+                _, old = self._users.popitem(last=False)
+                if old.task is not None:
+                    old.task.cancel()
+        else:
+            self._users.move_to_end(key)
+        return q
+
+    def take(self, username, spotify_token, limit):
+        """`limit` cards queued for this user and token, or None if the queue can't cover it."""
+        q = self._queue(username, spotify_token)
+        if q.cards and time.monotonic() - q.filled_at > QUEUE_TTL_S:
+            self.dropped += len(q.cards)
+            q.cards.clear()
+        # Re-filter against swipes that arrived since the cards were queued
+        seen = swipe_store.get_user_swipes(username).seen
+        fresh = [c for c in q.cards if c.get("id") not in seen]
+        self.dropped += len(q.cards) - len(fresh)
+        q.cards = deque(fresh)
+        if len(q.cards) < limit:
+            self.misses += 1
+            return None
+        self.hits += 1
+        out = [q.cards.popleft() for _ in range(limit)]
+        q.mark_served(out)
+        return out
+
+    def mark_served(self, username, spotify_token, cards):
+        self._queue(username, spotify_token).mark_served(cards)
+
+    def refill(self, username, spotify_token, limit, compute):
+        """
+        Top the queue up to PREFETCH_BATCHES * limit cards in the background.
+        compute(n, exclude) must return up to n new cards, skipping ids in `exclude`.
+        """
+        q = self._queue(username, spotify_token)
+        target = min(PREFETCH_BATCHES * limit, MAX_QUEUED_CARDS)
+        if len(q.cards) >= target or (q.task is not None and not q.task.done()):
+            return
+
+        async def run():
+            exclude = q.served | {c.get("id") for c in q.cards}
+            cards = await run_with_budget(compute(target - len(q.cards), exclude), REFILL_BUDGET_S)
+            if not q.cards:
+                q.filled_at = time.monotonic()
+            q.cards.extend(c for c in cards if c.get("id") not in exclude)
+
+        q.task = spawn_detached(run())
+        q.task.add_done_callback(_log_failure)
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "queued_cards": sum(len(q.cards) for q in self._users.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "dropped": self.dropped,
+        }
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        print("Prefetch failed:", task.exception())
+
+
+queues = PrefetchQueues()
@@ -0,0 +1,171 @@
+# ratelimit.py
+# Client-side pacing for upstream APIs, used by http_client for every call.
+# Each host (and each Spotify access token) gets a token bucket; callers
+# reserve a slot and sleep until it comes up, so a burst is spread out instead
+# of tripping the provider's limit. A 429/503 with Retry-After blocks the whole
+# host until then, and the callers queued behind it are released one bucket
+# slot at a time rather than all at once.
+#
+# Background work (library walks) doesn't queue with everyone else: it first
+# waits on its own, smaller bucket (BACKGROUND_LIMITS) and then only takes a
+# host/token slot that is free right now, so foreground calls always go first.
+
+import hashlib
+import os
+import random
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+# host -> (requests per second, burst). Hosts not listed are not paced.
+HOST_LIMITS = {
+    "api.spotify.com": (float(os.getenv("SPOTIFY_RPS", "10")), 20),
+    "accounts.spotify.com": (5.0, 10),
+    "ws.audioscrobbler.com": (5.0, 5),
+    "api.openweathermap.org": (1.0, 5),
+}
+# Per access token (Spotify limits are per app, but one user shouldn't starve the rest)
+TOKEN_LIMIT = (float(os.getenv("PER_TOKEN_RPS", "4")), 8)
+# Background share per host, on top of the limits above
+BACKGROUND_LIMITS = {
+    "api.spotify.com": (float(os.getenv("SPOTIFY_BACKGROUND_RPS", "2")), 2),
+}
+BACKGROUND_POLL_S = 0.1  # how often background calls look for a free slot
+MAX_TOKEN_BUCKETS = 10000
+MAX_RETRY_AFTER_S = 120.0
+RELEASE_JITTER_S = 0.25  # spread of the first requests after a Retry-After block
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        """Take one token; returns how long to wait before it is ours (tokens may go negative)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens += 1
+
+    def available(self, now):
+        return min(self.capacity, self.tokens + (now - self.updated) * self.rate) >= 1
+
+
+class Limiter:
+    def __init__(self):
+        self._hosts = {}
+        self._tokens = OrderedDict()
+        self._blocked_until = {}
+        self._background = {}
+        self.throttled = 0       # reservations that had to wait
+        self.retry_after_blocks = 0
+
+    def _buckets(self, host, token_key):
+        out = []
+        limit = HOST_LIMITS.get(host)
+        if limit is not None:
+            bucket = self._hosts.get(host)
+            if bucket is None:
+                bucket = self._hosts[host] = TokenBucket(*limit)
+            out.append(bucket)
+        if token_key is not None and limit is not None:
+            bucket = self._tokens.get(token_key)
+            if bucket is None:
+                bucket = self._tokens[token_key] = TokenBucket(*TOKEN_LIMIT)
+                while len(self._tokens) > MAX_TOKEN_BUCKETS:
+                    self._tokens.popitem(last=False)
+            else:
+                self._tokens.move_to_end(token_key)
+            out.append(bucket)
+        return out
+
+    def reserve(self, host, token_key=None):
+        """
+        Reserve a request slot. Returns (delay_s, release): sleep delay_s before
+        sending, or call release() to hand the slot back if you won't send.
+        """
+        now = time.monotonic()
+        buckets = self._buckets(host, token_key)
+        delay = max([b.reserve(now) for b in buckets], default=0.0)
+        blocked = self._blocked_until.get(host, 0.0) - now
+        if blocked > 0:
+            delay = max(delay, blocked + random.uniform(0, RELEASE_JITTER_S))
+        if delay > 0:
+            self.throttled += 1
+
+        def release():
+            for b in buckets:
+                b.refund()
+
+        return delay, release
+
+    def reserve_background(self, host):
+        """Delay before a background call may look for a slot on `host` (its own budget)."""
+        limit = BACKGROUND_LIMITS.get(host)
+        if limit is None:
+            return 0.0
+        bucket = self._background.get(host)
+        if bucket is None:
+            bucket = self._background[host] = TokenBucket(*limit)
+        return bucket.reserve(time.monotonic())
+
+    def try_reserve(self, host, token_key=None):
+        """Take a slot only if one is free right now (used for hedged requests)."""
+        now = time.monotonic()
+        if self._blocked_until.get(host, 0.0) > now:
+            return False
+        buckets = self._buckets(host, token_key)
+        if not all(b.available(now) for b in buckets):
+            return False
+        for b in buckets:
+            b.reserve(now)
+        return True
+
+    def block(self, host, seconds):
+        """Honour Retry-After: nothing goes to `host` for `seconds`."""
+        until = time.monotonic() + min(seconds, MAX_RETRY_AFTER_S)
+        if until > self._blocked_until.get(host, 0.0):
+            self._blocked_until[host] = until
+            self.retry_after_blocks += 1
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "throttled": self.throttled,
+            "retry_after_blocks": self.retry_after_blocks,
+            "blocked_hosts": sorted(h for h, t in self._blocked_until.items() if t > now),
+            "token_buckets": len(self._tokens),
+        }
+
+
+def token_key(headers):
+    """Bucket key for the caller's bearer token (hashed, never stored raw)."""
+    auth = (headers or {}).get("Authorization")
+    if not auth:
+        return None
+    return hashlib.sha256(auth.encode()).hexdigest()[:32]
+
+
+def parse_retry_after(value):
+    """Retry-After as seconds (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+limiter = Limiter()
@@ -0,0 +1,199 @@
+# response_cache.py
+# In-process cache for Spotify GET reads (profile, top tracks, recently played,
+# saved-tracks pages). Entries are keyed by the Spotify *user id* + endpoint +
+# params, not by the raw token, so a refreshed token still hits the cache.
+#
+# - per-endpoint TTLs
+# - LRU eviction once the stored response bytes exceed MAX_BYTES
+# - stale entries with an ETag are revalidated with If-None-Match (304 = cheap)
+# - hit / miss / revalidation / eviction counters via stats()
+# - second tier: shared_cache (one SQLite file per host), so a response fetched
+#   by one worker process is served by all of them
+# - raw bytes are stored and decoded per read (payloads.loads, or a lean
+#   decoder the caller passes in)
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import http_client
+import payloads
+import shared_cache
+
+PROFILE_URL = "https://api.spotify.com/v1/me"
+
+# Seconds an entry is served without asking Spotify again
+ENDPOINT_TTLS = {
+    "profile": 30 * 60,
+    "top_tracks": 30 * 60,
+    "recently_played": 60,
+    "saved_tracks": 5 * 60,
+}
+DEFAULT_TTL = 60
+
+MAX_BYTES = 64 * 1024 * 1024
+MAX_TOKENS = 10000
+TOKEN_USER_TTL = 3600  # Spotify access tokens live an hour
+
+
+class _Entry:
+    __slots__ = ("body", "etag", "expires_at")
+
+    def __init__(self, body, etag, expires_at):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self.shared_hits = 0  # misses here answered by the cross-process tier
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, body, etag, ttl):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old.body)
+        self._entries[key] = _Entry(body, etag, time.monotonic() + ttl)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted.body)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "evictions": self.evictions,
+            "shared_hits": self.shared_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+cache = ResponseCache()
+
+# sha256(token) -> Spotify user id
+_token_users = OrderedDict()
+
+
+def _token_hash(access_token):
+    return hashlib.sha256(access_token.encode()).hexdigest()[:32]
+
+
+def _shared_key(key):
+    return "spotify:" + json.dumps(key)
+
+
+async def _fetch(access_token, key, url, params, ttl, decode):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    entry = cache.get(key)
+    if entry is not None and entry.expires_at > time.monotonic():
+        cache.hits += 1
+        return decode(entry.body)
+
+    # Another worker may have fetched it already
+    shared = shared_cache.get(_shared_key(key))
+    if shared is not None:
+        body, etag, left = shared
+        cache.hits += 1
+        cache.shared_hits += 1
+        cache.put(key, body, etag, min(ttl, left))
+        return decode(body)
+
+    if entry is not None and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    response = await http_client.get(url, headers=headers, params=params)
+
+    if response.status_code == 304 and entry is not None:
+        cache.hits += 1
+        cache.revalidated += 1
+        cache.put(key, entry.body, entry.etag, ttl)
+        shared_cache.put(_shared_key(key), entry.body, ttl, entry.etag)
+        return decode(entry.body)
+
+    cache.misses += 1
+    if response.status_code != 200:
+        print(f"Spotify API error: {response.status_code} - {response.text[:200]}")
+        return None
+    cache.put(key, response.content, response.headers.get("ETag"), ttl)
+    shared_cache.put(_shared_key(key), response.content, ttl, response.headers.get("ETag"))
+    return decode(response.content)
+
+
+async def get_user_id(access_token):
+    """Spotify user id behind a token (one /v1/me call per new token)."""
+    th = _token_hash(access_token)
+    uid = _token_users.get(th)
+    if uid is not None:
+        _token_users.move_to_end(th)
+        return uid
+    shared = shared_cache.get("spotify-user:" + th)
+    if shared is not None:
+        uid = shared[0]
+        _remember_token(th, uid)
+        return uid
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = await http_client.get(PROFILE_URL, headers=headers)
+    if response.status_code != 200:
+        print(f"Spotify API error: {response.status_code} - {response.text[:200]}")
+        return None
+    uid = payloads.loads(response.content).get("id")
+    if not uid:
+        return None
+    _remember_token(th, uid)
+    shared_cache.put("spotify-user:" + th, uid, TOKEN_USER_TTL)
+    # The profile we just downloaded doubles as the per-user profile entry
+    key = (uid, "profile", ())
+    etag = response.headers.get("ETag")
+    cache.put(key, response.content, etag, ENDPOINT_TTLS["profile"])
+    shared_cache.put(_shared_key(key), response.content, ENDPOINT_TTLS["profile"], etag)
+    return uid
+
+
+def remember_user(access_token, uid, ttl=TOKEN_USER_TTL):
+    """Record who a token belongs to when we already know (e.g. a token we just refreshed), saving the /v1/me call."""
+    th = _token_hash(access_token)
+    _remember_token(th, uid)
+    shared_cache.put("spotify-user:" + th, uid, ttl)
+
+
+def _remember_token(th, uid):
+    _token_users[th] = uid
+    while len(_token_users) > MAX_TOKENS:
+        _token_users.popitem(last=False)
+
+
+async def spotify_get(access_token, endpoint, url, params=None, decode=payloads.loads):
+    """
+    Cached Spotify GET. Returns decode(body) (the JSON body by default), or
+    None on any non-200. `endpoint` picks the TTL and is part of the cache key.
+    """
+    ttl = ENDPOINT_TTLS.get(endpoint, DEFAULT_TTL)
+    uid = await get_user_id(access_token)
+    if uid is None:
+        return None
+    key = (uid, endpoint, tuple(sorted((params or {}).items())))
+    return await _fetch(access_token, key, url, params, ttl, decode)
+
+
+def stats():
+    return cache.stats()
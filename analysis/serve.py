@@ -0,0 +1,41 @@
+# serve.py
+# Production entry point: several uvicorn worker processes on one port.
+#
+#   python serve.py                      # WEB_CONCURRENCY workers (default: one per core)
+#   python serve.py --workers 4 --port 8000
+#
+# Each worker warms itself up in the background (see main.warm_up) and answers
+# /ready with 503 until it has. Workers on the same host share the shared_cache
+# SQLite tier, so adding workers doesn't multiply cold Spotify/weather misses.
+# uvicorn picks uvloop/httptools automatically when they are installed.
+# It listens on 127.0.0.1 (the Node backend's side of the host); pass
+# --host 0.0.0.0 only behind something that authenticates callers.
+
+import argparse
+import os
+
+import uvicorn
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run the analysis service with multiple workers")
+    ap.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    ap.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    ap.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "warning"))
+    args = ap.parse_args(argv)
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+        access_log=False,          # per-route counts/latency are on /metrics
+        timeout_keep_alive=30,     # clients (Node) reuse connections between swipes
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# shared_cache.py
+# Host-wide cache tier shared by every worker process (SQLite in WAL mode,
+# SHARED_CACHE_PATH, default in the temp dir). Each worker keeps its own
+# in-process caches as the first tier; on a miss there it checks here before
+# going upstream, and every upstream answer is written back here. With N
+# workers a user's Spotify reads / token lookup / weather are fetched once per
+# host instead of once per worker.
+#
+# Values are bytes (or str) with a TTL and an optional small `meta` string
+# (e.g. an ETag). Nothing here ever waits on the event loop:
+# - reads are indexed point lookups on their own connection with no busy
+#   timeout: if another worker holds a lock right then, the read is a miss
+# - writes (and the expiry/size sweeps) are queued to one writer thread per
+#   process, which may wait on the lock; when it falls behind, writes are dropped
+# Any other SQLite error turns the tier off for RETRY_AFTER_S and callers simply miss.
+
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+DB_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "goosechase-shared-cache.sqlite"))
+ENABLED = os.getenv("SHARED_CACHE", "1") != "0"
+MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_MB", "256")) * 1024 * 1024
+SWEEP_EVERY = 500       # writes between expiry/size sweeps
+MAX_QUEUED = 1000       # pending writes before new ones are dropped
+WRITE_TIMEOUT_S = 2.0   # how long the writer waits for another worker's lock
+RETRY_AFTER_S = 30.0
+
+_reader = None
+_pid = None
+_writes_queue = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+_failed_at = 0.0
+_writes = 0
+
+stats = {"hits": 0, "misses": 0, "busy": 0, "writes": 0, "dropped": 0, "errors": 0}
+
+
+def _connect(timeout):
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=timeout)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS shared_cache ("
+        " key TEXT PRIMARY KEY, value BLOB NOT NULL, meta TEXT,"
+        " expires_at REAL NOT NULL, size INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS shared_cache_expires ON shared_cache (expires_at)")
+    return conn
+
+
+def _available():
+    return ENABLED and time.monotonic() - _failed_at >= RETRY_AFTER_S
+
+
+def _failed(e):
+    global _failed_at
+    print("Shared cache unavailable:", e)
+    stats["errors"] += 1
+    _failed_at = time.monotonic()
+
+
+def _is_busy(e):
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e))
+
+
+def get(key):
+    """(value, meta, seconds_left) for a live entry, or None."""
+    global _reader, _pid
+    row = None
+    if _available():
+        try:
+            # A connection must not cross a fork: reopen in each worker process
+            if _reader is None or _pid != os.getpid():
+                _reader, _pid = _connect(0), os.getpid()
+            row = _reader.execute(
+                "SELECT value, meta, expires_at FROM shared_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            if _is_busy(e):
+                stats["busy"] += 1
+            else:
+                _reader = None
+                _failed(e)
+    if row is None:
+        stats["misses"] += 1
+        return None
+    stats["hits"] += 1
+    value, meta, expires_at = row
+    return value, meta, expires_at - time.time()
+
+
+def _put(db, key, value, ttl, meta, now):
+    global _writes
+    db.execute(
+        "INSERT OR REPLACE INTO shared_cache VALUES (?, ?, ?, ?, ?)",
+        (key, value, meta, now + ttl, len(value)),
+    )
+    _writes += 1
+    if _writes % SWEEP_EVERY == 0:
+        db.execute("DELETE FROM shared_cache WHERE expires_at <= ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM shared_cache").fetchone()[0]
+        if total > MAX_BYTES:
+            # Soonest-to-expire entries go first until we're back under the cap
+            freed = 0
+            for old_key, old_size in db.execute("SELECT key, size FROM shared_cache ORDER BY expires_at").fetchall():
+                if total - freed <= MAX_BYTES:
+                    break
+                db.execute("DELETE FROM shared_cache WHERE key = ?", (old_key,))
+                freed += old_size
+
+
+def _write_loop(pending):
+    db = None
+    while True:
+        batch = [pending.get()]
+        while len(batch) < MAX_QUEUED:
+            try:
+                batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        if _available():
+            try:
+                if db is None:
+                    db = _connect(WRITE_TIMEOUT_S)
+                with db:  # one transaction per batch
+                    for item in batch:
+                        _put(db, *item)
+                stats["writes"] += len(batch)
+            except sqlite3.Error as e:
+                if _is_busy(e):
+                    stats["dropped"] += len(batch)
+                else:
+                    db = None
+                    _failed(e)
+        else:
+            stats["dropped"] += len(batch)
+        for _ in batch:
+            pending.task_done()
+
+
+def _writer():
+    global _writes_queue, _writer_pid
+    # Threads don't survive a fork either: one writer per worker process
+    if _writes_queue is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writes_queue is None or _writer_pid != os.getpid():
+                pending = queue.Queue()
+                threading.Thread(target=_write_loop, args=(pending,), name="shared-cache-writer", daemon=True).start()
+                _writes_queue, _writer_pid = pending, os.getpid()
+    return _writes_queue
+
+
+def put(key, value, ttl, meta=None):
+    if ttl <= 0 or not _available():
+        return
+    pending = _writer()
+    if pending.qsize() >= MAX_QUEUED:
+        stats["dropped"] += 1
+        return
+    pending.put((key, value, ttl, meta, time.time()))
+
+
+def flush():
+    """Block until the queued writes are done (shutdown, tests)."""
+    if _writes_queue is not None and _writer_pid == os.getpid():
+        _writes_queue.join()
+
+
+def get_stats():
+    lookups = stats["hits"] + stats["misses"]
+    return dict(stats, enabled=ENABLED, hit_rate=round(stats["hits"] / lookups, 4) if lookups else 0.0)
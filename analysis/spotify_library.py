@@ -0,0 +1,119 @@
+# spotify_library.py
+# Streaming reader for the user's saved-tracks library (/v1/me/tracks).
+# Pages are pulled with bounded concurrency and handed out one page at a time,
+# so even very large libraries are walked without holding them in memory.
+# Pages are requested for the user's market (market=from_token), which also
+# drops the per-track available_markets lists from the payload, and decoded
+# straight into Tracks (payloads.saved_tracks_page).
+#
+# Only the first page is on a request's critical path: it is cached (and
+# shared between workers) and paced like any other call. The rest of the walk
+# runs at background priority (see ratelimit.py) and isn't cached, so large
+# libraries neither crowd out interactive calls nor fill the caches.
+
+import asyncio
+import random
+from collections import deque
+
+import http_client
+import payloads
+import response_cache
+
+SAVED_TRACKS_URL = "https://api.spotify.com/v1/me/tracks"
+PAGE_SIZE = 50            # Spotify max for /me/tracks
+PAGE_CONCURRENCY = 4      # pages in flight at once
+MAX_LIBRARY_ITEMS = 5000  # safety cap for huge libraries
+MARKET = "from_token"
+
+
+async def _get_first_page(access_token, page_size):
+    return await response_cache.spotify_get(
+        access_token, "saved_tracks", SAVED_TRACKS_URL, _page_params(page_size, 0), decode=payloads.saved_tracks_page
+    )
+
+
+async def _get_page(access_token, url, params=None):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = await http_client.get(url, headers=headers, params=params, background=True)
+    if response.status_code != 200:
+        print(f"Spotify API error: {response.status_code} - {response.text}")
+        return None
+    return payloads.saved_tracks_page(response.content)
+
+
+def _page_params(limit, offset):
+    return {"limit": limit, "offset": offset, "market": MARKET}
+
+
+async def iter_saved_tracks(access_token, page_size=PAGE_SIZE, concurrency=PAGE_CONCURRENCY,
+                            max_items=MAX_LIBRARY_ITEMS):
+    """
+    Async generator over the Tracks in the user's library.
+    The first page tells us `total`; the remaining pages are offset-addressable,
+    so they are fetched through a sliding window of `concurrency` requests.
+    Without a total we fall back to following the `next` links.
+    """
+    first = await _get_first_page(access_token, page_size)
+    if not first:
+        return
+    for track in first.tracks:
+        yield track
+
+    next_url = first.next
+    if not next_url:
+        return
+
+    total = min(first.total or 0, max_items)
+    if not total:
+        seen = len(first.tracks)
+        while next_url and seen < max_items:
+            page = await _get_page(access_token, next_url)
+            if not page:
+                return
+            for track in page.tracks:
+                yield track
+            seen += len(page.tracks)
+            next_url = page.next
+        return
+
+    offsets = iter(range(page_size, total, page_size))
+
+    def _fetch(offset):
+        return asyncio.create_task(
+            _get_page(access_token, SAVED_TRACKS_URL, _page_params(page_size, offset))
+        )
+
+    pending = deque(_fetch(o) for o, _ in zip(offsets, range(concurrency)))
+    try:
+        while pending:
+            page = await pending.popleft()
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(_fetch(offset))
+            if not page:
+                return
+            for track in page.tracks:
+                yield track
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class Reservoir:
+    """Uniform random sample of `k` items from a stream of unknown length (Algorithm R)."""
+    __slots__ = ("k", "seen", "items", "_rng")
+
+    def __init__(self, k, rng=None):
+        self.k = k
+        self.seen = 0
+        self.items = []
+        self._rng = rng or random
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            j = self._rng.randrange(self.seen)
+            if j < self.k:
+                self.items[j] = item
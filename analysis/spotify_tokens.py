@@ -0,0 +1,245 @@
+# spotify_tokens.py
+# Spotify access tokens per user, kept valid ahead of expiry.
+#
+# The backend stores spotifyAccessToken / spotifyRefreshToken /
+# spotifyTokenExpiresAt on User (see backend/src/routes/spotify.ts). We read
+# them through swipe_db and hand every Spotify helper a token that is still
+# valid, instead of whatever the caller sent:
+#
+# - under REFRESH_AHEAD_S left, the request gets the current token and one
+#   background refresh starts; only under MIN_LEFT_S does a request wait
+# - concurrent refreshes for a user share one call (SingleFlight)
+# - run() refreshes recently active users before they would need it
+# - before calling accounts.spotify.com we check whether another worker
+#   (shared_cache) or the backend (db) already holds a newer token
+#
+# The managed token is only used when the caller presents a token we know
+# belongs to that username (the db's, or one we handed out for it): naming a
+# user is not enough to act with their Spotify account. Everyone else, and
+# users we know nothing about (no db, not connected), keep their own token.
+# The db is the backend's (Prisma owns User): we only read it. A token we
+# refresh stays in this manager and is shared with the other workers through
+# shared_cache; a refresh token Spotify rotates for us is kept here only.
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+
+import http_client
+import response_cache
+import shared_cache
+import swipe_db
+from breaker import CircuitOpen
+from deadline import spawn_detached
+from singleflight import SingleFlight
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
+CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+
+REFRESH_AHEAD_S = 5 * 60   # refresh in the background once less than this is left
+MIN_LEFT_S = 60            # below this a request waits for the refresh (same grace as the backend)
+SWEEP_INTERVAL_S = 60
+ACTIVE_WINDOW_S = 30 * 60  # run() keeps tokens warm for users seen this recently
+MISS_TTL_S = 60            # don't look an unknown user up in the db again for this long
+RETRY_AFTER_S = 30.0       # wait after a failed refresh before trying again
+MAX_USERS = 10000
+
+
+def _token_hash(access_token):
+    return hashlib.sha256(access_token.encode()).hexdigest()[:32]
+
+
+def _shared_key(username):
+    return "spotify-token:" + username
+
+
+class _Tokens:
+    __slots__ = ("access", "refresh", "expires_at", "spotify_id", "used_at", "failed_at", "task")
+
+    def __init__(self, access, refresh, expires_at, spotify_id):
+        self.access = access
+        self.refresh = refresh
+        self.expires_at = expires_at or 0  # epoch seconds, like User.spotifyTokenExpiresAt
+        self.spotify_id = spotify_id
+        self.used_at = 0.0
+        self.failed_at = 0.0
+        self.task = None
+
+
+class TokenManager:
+    def __init__(self):
+        self._users = OrderedDict()        # username -> _Tokens
+        self._token_users = OrderedDict()  # sha256(access token) -> username, for token-only requests
+        self._missing = {}                 # username -> when a db lookup found nothing
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.passthrough = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+        self.adopted = 0  # refreshes answered by a newer token from another worker or the backend
+        self.unowned = 0  # requests naming a user their token doesn't belong to
+
+    async def resolve(self, access_token, username=None):
+        """A valid access token for this request: the managed one for the user, else the caller's own."""
+        if username is None and access_token:
+            username = self._token_users.get(_token_hash(access_token))
+        entry = await self._entry(username) if username else None
+        if entry is None:
+            self.passthrough += 1
+            return access_token
+        if not access_token or self._token_users.get(_token_hash(access_token)) != username:
+            self.unowned += 1
+            return access_token
+        entry.used_at = time.time()
+        left = entry.expires_at - entry.used_at
+        if entry.access and left > MIN_LEFT_S:
+            self.hits += 1
+            if left < REFRESH_AHEAD_S:
+                self._refresh_in_background(username, entry)
+            return entry.access
+        fresh = await self.refresh(username)
+        if fresh is not None:
+            return fresh.access
+        return entry.access if entry.access and left > 0 else access_token
+
+    async def refresh(self, username):
+        """Refresh `username`'s token now (one call however many requests ask); the entry, or None."""
+        return await self._flight.do(username, lambda: self._refresh(username))
+
+    async def run(self):
+        """Background loop (started by main.py): refresh active users' tokens before they expire."""
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL_S)
+            now = time.time()
+            for username, entry in list(self._users.items()):
+                if now - entry.used_at < ACTIVE_WINDOW_S and entry.expires_at - now < REFRESH_AHEAD_S + SWEEP_INTERVAL_S:
+                    self._refresh_in_background(username, entry)
+
+    def _refresh_in_background(self, username, entry):
+        if entry.task is not None and not entry.task.done():
+            return
+        self.background_refreshes += 1
+
+        async def run():
+            try:
+                await self.refresh(username)
+            except Exception as e:
+                print("Spotify token refresh failed:", username, e)
+
+        entry.task = spawn_detached(run())
+
+    async def _entry(self, username):
+        entry = self._users.get(username)
+        if entry is not None:
+            self._users.move_to_end(username)
+            return entry
+        missed_at = self._missing.get(username)
+        if missed_at is not None and time.monotonic() - missed_at < MISS_TTL_S:
+            return None
+        row = await swipe_db.fetch_spotify_tokens(username)
+        if not row or not (row[0] or row[1]):
+            if len(self._missing) >= MAX_USERS:
+                self._missing.clear()
+            self._missing[username] = time.monotonic()
+            return None
+        entry = _Tokens(*row)
+        self._store(username, entry)  # the db's token identifies the user too
+        self._adopt_shared(username, entry)
+        return entry
+
+    def _store(self, username, entry):
+        self._users[username] = entry
+        self._users.move_to_end(username)
+        while len(self._users) > MAX_USERS:
+            self._users.popitem(last=False)
+        if entry.access:
+            # Old hashes stay mapped, so a client still holding the previous token gets the new one
+            self._token_users[_token_hash(entry.access)] = username
+            while len(self._token_users) > 2 * MAX_USERS:
+                self._token_users.popitem(last=False)
+
+    def _adopt(self, username, entry, access, expires_at, refresh=None):
+        expires_at = expires_at or 0
+        if not access or expires_at - time.time() <= REFRESH_AHEAD_S or expires_at <= entry.expires_at:
+            return False
+        entry.access, entry.expires_at = access, expires_at
+        entry.refresh = refresh or entry.refresh
+        self._store(username, entry)
+        return True
+
+    def _adopt_shared(self, username, entry):
+        shared = shared_cache.get(_shared_key(username))
+        if shared is None:
+            return False
+        value = json.loads(shared[0])
+        return self._adopt(username, entry, value["access"], value["expires_at"])
+
+    async def _refresh(self, username):
+        entry = self._users.get(username)
+        if entry is None:
+            return None
+        if self._adopt_shared(username, entry):
+            self.adopted += 1
+            return entry
+        row = await swipe_db.fetch_spotify_tokens(username)
+        if row and self._adopt(username, entry, row[0], row[2], row[1]):
+            self.adopted += 1
+            return entry
+        if not (entry.refresh and CLIENT_ID and CLIENT_SECRET):
+            return None
+        if time.monotonic() - entry.failed_at < RETRY_AFTER_S:
+            return None
+
+        self.refreshes += 1
+        try:
+            response = await http_client.post(
+                TOKEN_URL,
+                auth=(CLIENT_ID, CLIENT_SECRET),
+                data={"grant_type": "refresh_token", "refresh_token": entry.refresh},
+            )
+        except (httpx.HTTPError, CircuitOpen) as e:
+            response = None
+            print("Spotify token refresh failed:", username, e)
+        if response is None or response.status_code != 200:
+            if response is not None:
+                print(f"Spotify token refresh failed: {username} {response.status_code} - {response.text[:200]}")
+            self.refresh_failures += 1
+            entry.failed_at = time.monotonic()
+            return None
+
+        data = response.json()
+        expires_in = data.get("expires_in") or 3600
+        entry.access = data["access_token"]
+        entry.refresh = data.get("refresh_token") or entry.refresh
+        entry.expires_at = time.time() + expires_in
+        self._store(username, entry)
+        # Other workers adopt this one instead of refreshing again (the refresh token stays here)
+        shared_cache.put(
+            _shared_key(username), json.dumps({"access": entry.access, "expires_at": entry.expires_at}), expires_in
+        )
+        if entry.spotify_id:
+            response_cache.remember_user(entry.access, entry.spotify_id, expires_in)
+        return entry
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "hits": self.hits,
+            "passthrough": self.passthrough,
+            "refreshes": self.refreshes,
+            "background_refreshes": self.background_refreshes,
+            "refresh_failures": self.refresh_failures,
+            "adopted": self.adopted,
+            "unowned": self.unowned,
+            "configured": bool(CLIENT_ID and CLIENT_SECRET),
+        }
+
+
+manager = TokenManager()
@@ -0,0 +1,201 @@
+# swipe_db.py
+# Optional read-only access to the backend's Prisma SQLite database.
+# When the file is reachable we read swipes and tracks straight from it
+# (indexed bulk queries, columnar results) instead of going through the Node
+# /api/swipes endpoint. Every function returns None when the database can't be
+# used, and callers fall back to HTTP.
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), "..", "backend", "prisma", "dev.db")
+DB_PATH = os.getenv("GOOSECHASE_DB_PATH", DEFAULT_DB_PATH)
+
+RETRY_AFTER_S = 30.0  # after a failure, don't try to open the db again for a while
+TRACK_CHUNK = 500     # ids per IN (...) query (SQLite host-parameter limit)
+
+_conn = None
+_lock = threading.Lock()
+_failed_at = 0.0
+
+
+class SwipeColumns:
+    """Swipes as parallel columns: Swipe.id, Track.id, 1 for RIGHT / 0 for LEFT."""
+    __slots__ = ("ids", "track_ids", "liked")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.track_ids = []
+        self.liked = bytearray()
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _connect():
+    global _conn, _failed_at
+    if _conn is not None:
+        return _conn
+    if time.monotonic() - _failed_at < RETRY_AFTER_S or not os.path.exists(DB_PATH):
+        return None
+    try:
+        uri = f"file:{os.path.abspath(DB_PATH)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        # Readers never block the Node writer in WAL mode; wait briefly on locks otherwise
+        conn.execute("PRAGMA query_only = 1")
+        conn.execute("PRAGMA busy_timeout = 2000")
+        conn.execute("PRAGMA mmap_size = 67108864")
+        conn.execute("SELECT 1 FROM Swipe LIMIT 1")
+        _conn = conn
+    except sqlite3.Error as e:
+        print("Swipe DB unavailable, using HTTP:", e)
+        _failed_at = time.monotonic()
+    return _conn
+
+
+def _run(fn, *args):
+    global _conn, _failed_at
+    with _lock:
+        conn = _connect()
+        if conn is None:
+            return None
+        try:
+            return fn(conn, *args)
+        except sqlite3.Error as e:
+            print("Swipe DB query failed, using HTTP:", e)
+            conn.close()
+            _conn = None
+            _failed_at = time.monotonic()
+            return None
+
+
+def _swipes_after(conn, username, after_id):
+    row = conn.execute('SELECT id FROM "User" WHERE username = ?', (username,)).fetchone()
+    cols = SwipeColumns()
+    if row is None:
+        return cols
+    # Served by @@index([userId, createdAt])
+    cur = conn.execute(
+        'SELECT id, trackId, direction = \'RIGHT\' FROM "Swipe" '
+        "WHERE userId = ? AND id > ? ORDER BY createdAt, id",
+        (row[0], after_id),
+    )
+    for sid, tid, liked in cur:
+        cols.ids.append(sid)
+        cols.track_ids.append(tid)
+        cols.liked.append(liked)
+    return cols
+
+
+def _all_swipes(conn):
+    cur = conn.execute(
+        'SELECT s.id, u.username, s.trackId, s.direction = \'RIGHT\' '
+        'FROM "Swipe" s JOIN "User" u ON u.id = s.userId ORDER BY s.id'
+    )
+    users, cols = [], SwipeColumns()
+    for sid, username, tid, liked in cur:
+        cols.ids.append(sid)
+        users.append(username)
+        cols.track_ids.append(tid)
+        cols.liked.append(liked)
+    return users, cols
+
+
+def _swipes_for_users(conn, usernames, after_id):
+    users, cols = [], SwipeColumns()
+    for i in range(0, len(usernames), TRACK_CHUNK):
+        chunk = usernames[i:i + TRACK_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        cur = conn.execute(
+            'SELECT s.id, u.username, s.trackId, s.direction = \'RIGHT\' '
+            'FROM "Swipe" s JOIN "User" u ON u.id = s.userId '
+            f"WHERE u.username IN ({marks}) AND s.id > ? ORDER BY s.id",
+            (*chunk, after_id),
+        )
+        for sid, username, tid, liked in cur:
+            cols.ids.append(sid)
+            users.append(username)
+            cols.track_ids.append(tid)
+            cols.liked.append(liked)
+    return users, cols
+
+
+def _all_tracks(conn):
+    cur = conn.execute('SELECT id, title, artist, imageUrl, previewUrl, spotifyUrl FROM "Track"')
+    return [
+        {
+            "title": title,
+            "artist": artist,
+            "preview_url": preview_url,
+            "image_url": image_url,
+            "spotify_url": spotify_url,
+            "id": tid,
+        }
+        for tid, title, artist, image_url, preview_url, spotify_url in cur
+    ]
+
+
+def _tracks(conn, track_ids):
+    out = {}
+    for i in range(0, len(track_ids), TRACK_CHUNK):
+        chunk = track_ids[i:i + TRACK_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        cur = conn.execute(
+            'SELECT id, title, artist, imageUrl, previewUrl, spotifyUrl FROM "Track" '
+            f"WHERE id IN ({marks})",
+            chunk,
+        )
+        for tid, title, artist, image_url, preview_url, spotify_url in cur:
+            out[tid] = {
+                "title": title,
+                "artist": artist,
+                "preview_url": preview_url,
+                "image_url": image_url,
+                "spotify_url": spotify_url,
+                "id": tid,
+            }
+    return out
+
+
+def _spotify_tokens(conn, username):
+    return conn.execute(
+        'SELECT spotifyAccessToken, spotifyRefreshToken, spotifyTokenExpiresAt, spotifyId FROM "User" '
+        "WHERE username = ?",
+        (username,),
+    ).fetchone()
+
+
+async def fetch_spotify_tokens(username):
+    """(access token, refresh token, expires at [epoch s], Spotify id) as stored by the backend; None without a db or user."""
+    return await asyncio.to_thread(_run, _spotify_tokens, username)
+
+
+async def fetch_swipes_after(username, after_id=0):
+    """SwipeColumns for swipes newer than after_id (oldest first), or None without a db."""
+    return await asyncio.to_thread(_run, _swipes_after, username, after_id)
+
+
+async def fetch_all_swipes():
+    """(usernames, SwipeColumns) for every swipe in the db, or None without a db."""
+    return await asyncio.to_thread(_run, _all_swipes)
+
+
+async def fetch_swipes_for_users(usernames, after_id=0):
+    """(usernames, SwipeColumns) for several users in one pooled query, or None without a db."""
+    return await asyncio.to_thread(_run, _swipes_for_users, list(usernames), after_id)
+
+
+async def fetch_tracks(track_ids):
+    """{track id: card dict} for the given ids, or None without a db."""
+    if not track_ids:
+        return {}
+    return await asyncio.to_thread(_run, _tracks, list(track_ids))
+
+
+async def fetch_all_tracks():
+    """Every row of the Track table as card dicts, or None without a db."""
+    return await asyncio.to_thread(_run, _all_tracks)
@@ -0,0 +1,156 @@
+# swipe_store.py
+# Local, per-user copy of the swipe history. The store remembers the last
+# Swipe.id it has seen, so each sync only pulls newer swipes from Node.
+#
+# Track ids are interned to small ints once (shared by all users), and each
+# user's "already swiped" set is a Bloom filter backed by a sorted int array:
+# a miss in the filter answers in O(1), and only filter hits are confirmed with
+# a binary search. At ~4 bytes per swipe + a few bits, tens of thousands of
+# swipes per user stay cheap.
+
+import asyncio
+import bisect
+from array import array
+from collections import OrderedDict
+
+MAX_USERS = 10000
+
+
+class TrackInterner:
+    """Maps Spotify track ids to dense ints (and back)."""
+
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+
+    def intern(self, track_id):
+        i = self._ids.get(track_id)
+        if i is None:
+            i = self._ids[track_id] = len(self._names)
+            self._names.append(track_id)
+        return i
+
+    def lookup(self, track_id):
+        return self._ids.get(track_id)
+
+    def name(self, i):
+        return self._names[i]
+
+
+interner = TrackInterner()
+
+
+class SeenIndex:
+    """Membership set over interned track ids: Bloom filter + exact sorted array."""
+
+    HASHES = 4
+    BITS_PER_ITEM = 10  # ~1% false positives, all confirmed exactly anyway
+
+    def __init__(self, capacity=256):
+        self._exact = array("i")
+        self._resize(capacity)
+
+    def _resize(self, capacity):
+        self.capacity = capacity
+        self._m = capacity * self.BITS_PER_ITEM
+        self._bits = bytearray((self._m + 7) // 8)
+        for i in self._exact:
+            self._set_bits(i)
+
+    def _positions(self, i):
+        h1 = (i * 0x9E3779B1) & 0xFFFFFFFF
+        h2 = ((i * 0x85EBCA77) & 0xFFFFFFFF) | 1
+        m = self._m
+        return [(h1 + k * h2) % m for k in range(self.HASHES)]
+
+    def _set_bits(self, i):
+        bits = self._bits
+        for p in self._positions(i):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def add(self, i):
+        exact = self._exact
+        pos = bisect.bisect_left(exact, i)
+        if pos < len(exact) and exact[pos] == i:
+            return
+        exact.insert(pos, i)
+        if len(exact) > self.capacity:
+            self._resize(self.capacity * 2)
+        else:
+            self._set_bits(i)
+
+    def has(self, i):
+        bits = self._bits
+        for p in self._positions(i):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        exact = self._exact
+        pos = bisect.bisect_left(exact, i)
+        return pos < len(exact) and exact[pos] == i
+
+    def __contains__(self, track_id):
+        i = interner.lookup(track_id) if isinstance(track_id, str) else track_id
+        return i is not None and self.has(i)
+
+    def __len__(self):
+        return len(self._exact)
+
+
+class UserSwipes:
+    __slots__ = ("last_swipe_id", "seen", "liked", "lock")
+
+    def __init__(self):
+        self.last_swipe_id = 0
+        self.seen = SeenIndex()
+        self.liked = array("i")  # interned ids of RIGHT swipes, oldest first
+        self.lock = asyncio.Lock()
+
+    def _add_one(self, sid, tid, liked):
+        if sid <= self.last_swipe_id or not tid:
+            return False
+        i = interner.intern(tid)
+        self.seen.add(i)
+        if liked:
+            self.liked.append(i)
+        self.last_swipe_id = sid
+        return True
+
+    def add(self, swipes):
+        """Merge normalized swipes (see fetch_user_swipes); returns the ones that were new."""
+        added = []
+        for s in sorted(swipes, key=lambda s: s.get("id") or 0):
+            liked = str(s.get("direction")).upper() == "RIGHT"
+            if self._add_one(s.get("id") or 0, s.get("trackId"), liked):
+                added.append(s)
+        return added
+
+    def add_columns(self, cols, positions=None):
+        """Merge swipe_db.SwipeColumns (ordered by id); returns the positions that were new."""
+        if positions is None:
+            positions = range(len(cols))
+        return [k for k in positions if self._add_one(cols.ids[k], cols.track_ids[k], cols.liked[k])]
+
+    def recent_likes(self, n=None):
+        """Liked track ids, newest first, without duplicates."""
+        out, picked = [], set()
+        for i in reversed(self.liked):
+            if i not in picked:
+                picked.add(i)
+                out.append(interner.name(i))
+                if n is not None and len(out) >= n:
+                    break
+        return out
+
+
+_users = OrderedDict()
+
+
+def get_user_swipes(username):
+    store = _users.get(username)
+    if store is None:
+        store = _users[username] = UserSwipes()
+        while len(_users) > MAX_USERS:
+            _users.popitem(last=False)
+    else:
+        _users.move_to_end(username)
+    return store
@@ -0,0 +1,40 @@
+# test_http_client.py
+# Regression: time spent queued behind our own rate limiter must not count
+# against an upstream's circuit breaker (only the send itself does).
+#   cd analysis && python -m pytest -q test_http_client.py
+
+import asyncio
+
+import httpx
+
+import breaker
+import http_client
+import ratelimit
+
+HOST = "api.spotify.com"
+
+
+def test_queued_healthy_calls_do_not_trip_the_breaker(monkeypatch):
+    # 40 calls paced at 50/s with no burst: most of them wait far longer than
+    # the slow-call threshold before they are sent, then answer at once
+    monkeypatch.setitem(ratelimit.HOST_LIMITS, HOST, (50.0, 1))
+    monkeypatch.setattr(ratelimit, "limiter", ratelimit.Limiter())
+    monkeypatch.setattr(breaker, "_breakers", {})
+    monkeypatch.setitem(breaker.SLOW_CALL_S, "spotify", 0.05)
+    monkeypatch.setattr(breaker, "ENABLED", True)
+
+    async def run():
+        http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda req: httpx.Response(200, json={})))
+        try:
+            responses = await asyncio.gather(*(http_client.get(f"https://{HOST}/v1/me") for _ in range(40)))
+        finally:
+            await http_client.aclose()
+        return responses
+
+    responses = asyncio.run(run())
+
+    assert all(r.status_code == 200 for r in responses)
+    assert ratelimit.limiter.throttled > 0
+    stats = breaker.get("spotify").stats()
+    assert stats["recent_failures"] == 0
+    assert not stats["open"]
@@ -0,0 +1,50 @@
+# test_llm_cache.py
+# Exact hits are shared; near-duplicate hits only ever return the same
+# owner's answer, so one user's analysis is never served to another.
+#   cd analysis && python -m pytest -q test_llm_cache.py
+
+import pytest
+
+import llm_cache
+
+SYSTEM = {"role": "system", "content": "You write character analyses."}
+STORY = [f"lyric line {i}" for i in range(10)]
+
+
+def _messages(lines):
+    return [SYSTEM, {"role": "user", "content": "\n".join(lines)}]
+
+
+@pytest.fixture(autouse=True)
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "DB_PATH", str(tmp_path / "llm.sqlite"))
+    monkeypatch.setattr(llm_cache, "_conn", None)
+    monkeypatch.setattr(llm_cache, "stats", dict.fromkeys(llm_cache.stats, 0))
+    yield
+    if llm_cache._conn is not None:
+        llm_cache._conn.close()
+
+
+def test_exact_hit_is_shared_and_whitespace_insensitive():
+    llm_cache.store("gpt-4", _messages(STORY), 0.7, "answer", 1.5, owner="alice")
+    spaced = ["  " + line.replace(" ", "   ") for line in STORY]
+    assert llm_cache.lookup("gpt-4", _messages(spaced), 0.7, owner="bob") == "answer"
+    assert llm_cache.lookup("gpt-4", _messages(STORY), 0.7) == "answer"
+    assert llm_cache.lookup("gpt-4", _messages(STORY), 0.2) is None
+    assert llm_cache.stats["saved_latency_s"] == 3.0
+
+
+def test_near_duplicate_only_within_the_same_owner():
+    llm_cache.store("gpt-4", _messages(STORY), 0.7, "alice's analysis", 1.0, owner="alice")
+    one_line_off = STORY[:-1] + ["a different lyric"]
+    assert llm_cache.lookup("gpt-4", _messages(one_line_off), 0.7, near_duplicates=True, owner="bob") is None
+    assert llm_cache.lookup("gpt-4", _messages(one_line_off), 0.7, near_duplicates=True) is None
+    assert llm_cache.lookup("gpt-4", _messages(one_line_off), 0.7, near_duplicates=True, owner="alice") == "alice's analysis"
+    assert llm_cache.stats["near_hits"] == 1
+
+
+def test_near_duplicate_needs_a_close_prompt():
+    llm_cache.store("gpt-4", _messages(STORY), 0.7, "answer", 1.0, owner="alice")
+    three_lines_off = STORY[:-2] + ["x", "y", "z"]
+    assert llm_cache.lookup("gpt-4", _messages(three_lines_off), 0.7, near_duplicates=True, owner="alice") is None
+    assert llm_cache.lookup("gpt-4", _messages(STORY[:-1] + ["x"]), 0.7, owner="alice") is None
@@ -0,0 +1,58 @@
+# test_prefetch.py
+# Prefetched cards come from one caller's Spotify library: they are only
+# served to the same username *and* token, never re-served once swiped, and
+# dropped once they are older than QUEUE_TTL_S.
+#   cd analysis && python -m pytest -q test_prefetch.py
+
+import asyncio
+
+import prefetch
+import swipe_store
+
+
+def _cards(n, start=0):
+    return [{"id": f"t{i}"} for i in range(start, start + n)]
+
+
+def _fill(queues, username, token, cards):
+    async def compute(n, exclude):
+        return [c for c in cards if c["id"] not in exclude][:n]
+
+    async def run():
+        queues.refill(username, token, 5, compute)
+        await queues._queue(username, token).task
+
+    asyncio.run(run())
+
+
+def test_queue_is_only_served_to_the_token_it_was_built_with():
+    queues = prefetch.PrefetchQueues()
+    _fill(queues, "iso-alice", "token-a", _cards(10))
+    assert queues.take("iso-alice", "token-b", 5) is None
+    assert queues.take("iso-alice", None, 5) is None
+    assert queues.take("iso-alice", "token-a", 5) == _cards(5)
+    assert queues.stats()["hits"] == 1
+
+
+def test_swiped_cards_are_not_served_again():
+    queues = prefetch.PrefetchQueues()
+    _fill(queues, "iso-bob", "token", _cards(10))
+    swipe_store.get_user_swipes("iso-bob").add([{"id": 1, "trackId": "t0", "direction": "LEFT"}])
+    served = queues.take("iso-bob", "token", 5)
+    assert [c["id"] for c in served] == ["t1", "t2", "t3", "t4", "t5"]
+    assert queues.stats()["dropped"] == 1
+
+
+def test_served_cards_are_not_queued_again():
+    queues = prefetch.PrefetchQueues()
+    queues.mark_served("iso-carol", "token", _cards(3))
+    _fill(queues, "iso-carol", "token", _cards(8))
+    assert [c["id"] for c in queues.take("iso-carol", "token", 5)] == ["t3", "t4", "t5", "t6", "t7"]
+
+
+def test_stale_queue_is_dropped(monkeypatch):
+    queues = prefetch.PrefetchQueues()
+    _fill(queues, "iso-dave", "token", _cards(10))
+    monkeypatch.setattr(prefetch, "QUEUE_TTL_S", -1.0)
+    assert queues.take("iso-dave", "token", 5) is None
+    assert queues.stats()["dropped"] == 10
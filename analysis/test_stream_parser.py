@@ -0,0 +1,43 @@
+# test_stream_parser.py
+# RecommendationStreamParser must give the same records as
+# parse_text_recommendations however the LLM output is split into chunks.
+#   cd analysis && python -m pytest -q test_stream_parser.py
+
+from ChatxLastFMreccomends import RecommendationStreamParser, parse_text_recommendations
+
+TEXT = (
+    "Title: Hurt\nArtist: Johnny Cash\nSuggested Lyrics: I hurt myself today\n---\n"
+    "Title: Creep\nArtist: Radiohead\nSuggested Lyrics: I'm a creep\n---\n"
+    "Title: Holocene\nArtist: Bon Iver\nSuggested Lyrics: And at once I knew\n"
+)
+
+
+def _parse(chunks):
+    parser = RecommendationStreamParser()
+    out = []
+    for chunk in chunks:
+        out += parser.feed(chunk)
+    return out + parser.close()
+
+
+def test_any_chunking_matches_the_batch_parser():
+    expected = parse_text_recommendations(TEXT)
+    assert len(expected) == 3
+    for size in (1, 2, 3, 7, 16, len(TEXT)):
+        chunks = [TEXT[i:i + size] for i in range(0, len(TEXT), size)]
+        assert _parse(chunks) == expected, size
+
+
+def test_records_are_returned_as_their_separator_arrives():
+    parser = RecommendationStreamParser()
+    assert parser.feed("Title: Hurt\nArtist: Johnny Cash\n") == []
+    assert parser.feed("-") == []
+    assert parser.feed("--\nTitle: Cr") == [{"title": "Hurt", "artist": "Johnny Cash"}]
+    assert parser.close() == []  # trailing block without an artist is dropped
+
+
+def test_separator_on_the_same_line_as_a_field():
+    assert _parse(["Title: A\nArtist: B---Title: C\nArtist: D"]) == [
+        {"title": "A", "artist": "B"},
+        {"title": "C", "artist": "D"},
+    ]
@@ -0,0 +1,65 @@
+# timing.py
+# Per-request stage timings. main.py opens a span set for each request; code
+# on the request path wraps its stages in `with stage("name"):` (upstream
+# calls are labelled automatically by http_client), and the totals go back to
+# the client as a Server-Timing header.
+#
+# Durations are summed per stage name, so stages that run concurrently (e.g.
+# gathered upstream calls) can add up to more than the request's total.
+# Every stage is also observed into metrics.STAGE_SECONDS. Only sampled
+# requests collect spans (metrics.should_sample); for the rest stage() is a
+# no-op.
+
+import contextvars
+import re
+import time
+from contextlib import contextmanager
+
+import metrics
+
+_spans = contextvars.ContextVar("timing_spans", default=None)
+
+_NAME_RE = re.compile(r"[^A-Za-z0-9_]")
+
+
+def begin(sampled=True):
+    """Start collecting for the current request; returns the {stage: seconds} dict (None if not sampled)."""
+    spans = {} if sampled else None
+    _spans.set(spans)
+    return spans
+
+
+def suspend():
+    """Stop collecting in this context (around spawning background work); pass the result to resume()."""
+    return _spans.set(None)
+
+
+def resume(token):
+    _spans.reset(token)
+
+
+def record(name, seconds):
+    spans = _spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+        metrics.STAGE_SECONDS.observe(seconds, name)
+
+
+@contextmanager
+def stage(name):
+    if _spans.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def server_timing(spans, total=None):
+    """Server-Timing header value, e.g. 'sync;dur=12.3, spotify;dur=80.1, total;dur=95.0'."""
+    parts = [f"{_NAME_RE.sub('_', name)};dur={seconds * 1000:.1f}" for name, seconds in spans.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,151 @@
+# tracks.py
+# Compact in-memory track type for the recommendation pipeline.
+#
+# A Track is built once, where a track enters the service (Spotify response,
+# Node swipe, db row), and carries its interned id (swipe_store.interner), so
+# later stages compare small ints instead of re-reading dicts or parsing URLs.
+# Cards (plain dicts) are only produced at the API boundary via as_card().
+#
+# CandidateSet keeps a batch of tracks as parallel columns (interned ids in an
+# int array + the Track objects), so filtering against seen/picked/excluded
+# ids is a set operation over ints.
+
+import re
+from array import array
+
+from swipe_store import interner
+
+TRACK_ID_RE = re.compile(r"^[A-Za-z0-9]{22}$")
+TRACK_URL_RE = re.compile(r"/track/([A-Za-z0-9]{22})")
+
+
+def extract_track_id(value):
+    """Spotify track id from a bare id or an open.spotify.com/track/... URL, else None."""
+    if not value:
+        return None
+    value = value.strip()
+    if TRACK_ID_RE.match(value):
+        return value
+    m = TRACK_URL_RE.search(value)
+    return m.group(1) if m else None
+
+
+class Track:
+    __slots__ = ("iid", "title", "artist", "preview_url", "image_url", "spotify_url")
+
+    def __init__(self, iid, title=None, artist=None, preview_url=None, image_url=None, spotify_url=None):
+        self.iid = iid
+        self.title = title
+        self.artist = artist
+        self.preview_url = preview_url
+        self.image_url = image_url
+        self.spotify_url = spotify_url
+
+    @property
+    def id(self):
+        return interner.name(self.iid)
+
+    @classmethod
+    def from_spotify(cls, t):
+        """From a Spotify API track object, or None if it has no usable id."""
+        tid = t.get("id") or extract_track_id((t.get("external_urls") or {}).get("spotify"))
+        if not tid:
+            return None
+        return cls(
+            interner.intern(tid),
+            t.get("name"),
+            (t.get("artists") or [{}])[0].get("name"),
+            t.get("preview_url"),
+            ((t.get("album") or {}).get("images") or [{}])[0].get("url"),
+            (t.get("external_urls") or {}).get("spotify"),
+        )
+
+    @classmethod
+    def from_card(cls, card):
+        """From a card dict (db rows, Node tracks already in card shape), or None without an id."""
+        tid = card.get("id") or extract_track_id(card.get("spotify_url"))
+        if not tid:
+            return None
+        return cls(
+            interner.intern(tid),
+            card.get("title"),
+            card.get("artist"),
+            card.get("preview_url"),
+            card.get("image_url"),
+            card.get("spotify_url"),
+        )
+
+    def as_card(self):
+        return {
+            "title": self.title,
+            "artist": self.artist,
+            "preview_url": self.preview_url,
+            "image_url": self.image_url,
+            "spotify_url": self.spotify_url,
+            "id": self.id,
+        }
+
+
+class CandidateSet:
+    """Ordered, duplicate-free batch of Tracks stored as (interned id, Track) columns."""
+
+    __slots__ = ("ids", "tracks", "_members")
+
+    def __init__(self, tracks=()):
+        self.ids = array("i")
+        self.tracks = []
+        self._members = set()
+        self.extend(tracks)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __contains__(self, iid):
+        return iid in self._members
+
+    def add(self, track):
+        if track is None or track.iid in self._members:
+            return False
+        self._members.add(track.iid)
+        self.ids.append(track.iid)
+        self.tracks.append(track)
+        return True
+
+    def extend(self, tracks):
+        for t in tracks:
+            self.add(t)
+
+    def without(self, *excludes):
+        """
+        New CandidateSet minus every id found in `excludes` (sets of interned
+        ids, or anything supporting `in` such as swipe_store.SeenIndex).
+        """
+        drop = set()
+        keep = self._members
+        for ex in excludes:
+            if isinstance(ex, (set, frozenset)):
+                drop |= keep & ex
+            else:
+                drop.update(i for i in keep if i in ex)
+        out = CandidateSet()
+        if not drop:
+            out.extend(self.tracks)
+        else:
+            out.extend(t for t in self.tracks if t.iid not in drop)
+        return out
+
+    def as_cards(self):
+        return [t.as_card() for t in self.tracks]
+
+
+def intern_ids(track_ids):
+    """Set of interned ids for string track ids (ids never seen before can't match anything)."""
+    out = set()
+    for tid in track_ids or ():
+        i = interner.lookup(tid)
+        if i is not None:
+            out.add(i)
+    return out
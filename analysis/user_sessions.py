@@ -0,0 +1,48 @@
+# user_sessions.py
+# Per-user session state for liked lyrics (replaces the old process-wide
+# `user_story` list). Each session keeps a bounded window of recent lyrics,
+# the lyrics not yet folded into the analysis, and the rolling summary, so an
+# analysis update only needs the summary + the new lyrics.
+
+import time
+from collections import OrderedDict, deque
+
+MAX_LYRICS = 50          # recent liked lyrics kept per user
+MAX_PENDING = 10         # new lyrics sent per analysis update (oldest dropped)
+SESSION_TTL_S = 6 * 3600
+MAX_SESSIONS = 10000
+
+
+class UserSession:
+    __slots__ = ("lyrics", "pending", "summary", "updated_at")
+
+    def __init__(self):
+        self.lyrics = deque(maxlen=MAX_LYRICS)
+        self.pending = deque(maxlen=MAX_PENDING)
+        self.summary = None
+        self.updated_at = time.monotonic()
+
+    def add_lyric(self, lyric):
+        if not lyric:
+            return
+        self.lyrics.append(lyric)
+        self.pending.append(lyric)
+        self.updated_at = time.monotonic()
+
+
+_sessions = OrderedDict()
+
+
+def get_session(user_id):
+    if user_id is None:
+        raise ValueError("a session needs a user_id")
+    session = _sessions.get(user_id)
+    if session is not None and time.monotonic() - session.updated_at > SESSION_TTL_S:
+        session = None
+    if session is None:
+        session = _sessions[user_id] = UserSession()
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    else:
+        _sessions.move_to_end(user_id)
+    return session
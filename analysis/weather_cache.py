@@ -0,0 +1,126 @@
+# weather_cache.py
+# Shared weather context, keyed by city (or a coarse lat/lon bucket).
+# Reads never wait on OpenWeatherMap: a fresh entry is returned as is, a stale
+# one is returned while a single background refresh runs (stale-while-
+# revalidate), and a cold key returns {} and starts the first fetch. However
+# many profile builds hit the same city, there is at most one upstream call
+# per key per refresh window (per host: fresh values are shared between
+# worker processes through shared_cache). At most MAX_KEYS locations are
+# kept; the least recently read go first.
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+import shared_cache
+from deadline import spawn_detached
+
+WEATHER_TTL_S = float(os.getenv("WEATHER_TTL_S", "900"))
+MAX_STALE_S = 3 * 3600       # past this, stale weather is no longer served
+RETRY_AFTER_S = 60.0         # wait after a failed refresh before trying again
+GEO_BUCKET_DEG = 0.1         # ~11 km buckets for lat/lon keys
+MAX_KEYS = 10000
+
+
+def weather_key(city=None, lat=None, lon=None):
+    if lat is not None and lon is not None:
+        return ("geo", round(lat / GEO_BUCKET_DEG), round(lon / GEO_BUCKET_DEG))
+    return ("city", (city or "").strip().lower())
+
+
+def bucket_center(key):
+    """(lat, lon) to query for a geo key, so every caller in the bucket shares one answer."""
+    return key[1] * GEO_BUCKET_DEG, key[2] * GEO_BUCKET_DEG
+
+
+def _shared_key(key):
+    return "weather:" + json.dumps(key)
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "failed_at", "task")
+
+    def __init__(self):
+        self.value = None
+        self.fetched_at = 0.0
+        self.failed_at = 0.0
+        self.task = None
+
+
+class WeatherCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def get(self, key, fetch):
+        """
+        Cached weather for `key` without waiting. `fetch()` is a coroutine
+        factory returning the weather dict ({} on failure).
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+            while len(self._entries) > MAX_KEYS:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        age = time.monotonic() - entry.fetched_at
+        if entry.value is None or age > WEATHER_TTL_S:
+            age = self._adopt_shared(key, entry, age)
+        if entry.value is not None and age <= WEATHER_TTL_S:
+            self.hits += 1
+            return entry.value
+        self._refresh(key, entry, fetch)
+        if entry.value is not None and age <= MAX_STALE_S:
+            self.stale_hits += 1
+            return entry.value
+        self.misses += 1
+        return {}
+
+    def _adopt_shared(self, key, entry, age):
+        # A fresh value another worker fetched beats refreshing it ourselves
+        shared = shared_cache.get(_shared_key(key))
+        if shared is None:
+            return age
+        value, _, left = shared
+        entry.value = json.loads(value)
+        entry.fetched_at = time.monotonic() - (WEATHER_TTL_S - left)
+        return WEATHER_TTL_S - left
+
+    def _refresh(self, key, entry, fetch):
+        if entry.task is not None and not entry.task.done():
+            return
+        if time.monotonic() - entry.failed_at < RETRY_AFTER_S:
+            return
+
+        async def run():
+            self.refreshes += 1
+            try:
+                value = await fetch()
+            except Exception as e:
+                print("Weather refresh failed:", e)
+                value = None
+            if value:
+                entry.value = value
+                entry.fetched_at = time.monotonic()
+                shared_cache.put(_shared_key(key), json.dumps(value), WEATHER_TTL_S)
+            else:
+                entry.failed_at = time.monotonic()
+
+        entry.task = spawn_detached(run())
+
+    def stats(self):
+        return {
+            "keys": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+        }
+
+
+cache = WeatherCache()
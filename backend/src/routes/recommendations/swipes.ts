@@ -113,6 +113,8 @@ router.post("/", async (req: Request, res: Response): Promise<void> => {
 });
 
 // Optional: fetch recent swipes (supports ?username=...&direction=LEFT|RIGHT&limit=50)
+// With ?afterId=N only swipes with id > N are returned, oldest first, so callers
+// can sync incrementally by passing the last id they have seen.
 router.get("/", async (req: Request, res: Response): Promise<void> => {
   try {
     console.log("[/api/swipes GET] query:", req.query);
@@ -126,6 +128,8 @@ router.get("/", async (req: Request, res: Response): Promise<void> => {
       dirQ === "LEFT" || dirQ === "RIGHT" ? (dirQ as Direction) : undefined;
 
     const take = Math.min(Math.max(parseInt(String(req.query.limit || "50"), 10) || 50, 1), 200);
+    const afterIdQ = parseInt(String(req.query.afterId ?? ""), 10);
+    const afterId = Number.isFinite(afterIdQ) ? afterIdQ : undefined;
 
     const user = await prisma.user.findUnique({ where: { username } });
     if (!user) {
@@ -134,8 +138,12 @@ router.get("/", async (req: Request, res: Response): Promise<void> => {
     }
 
     const swipes = await prisma.swipe.findMany({
-      where: { userId: user.id, ...(dir ? { direction: dir } : {}) },
-      orderBy: { createdAt: "desc" },
+      where: {
+        userId: user.id,
+        ...(dir ? { direction: dir } : {}),
+        ...(afterId !== undefined ? { id: { gt: afterId } } : {}),
+      },
+      orderBy: afterId !== undefined ? { id: "asc" } : { createdAt: "desc" },
       take,
       include: { track: true },
     });